@@ -0,0 +1,242 @@
+import numpy as np
+from typing import Tuple, Sequence, Callable
+
+try:
+    import numba
+except ImportError:  # The JIT backend is optional.
+    numba = None
+
+
+BACKENDS = ("python", "jit")
+
+_backend = "jit" if numba is not None else "python"
+
+
+def jit_available() -> bool:
+    return numba is not None
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def set_backend(name: str) -> None:
+    """Select the backend used for the sequential loops in parse and classification.
+
+    The "python" backend runs the original pure Python code while "jit" runs compiled kernels (requires numba).
+    """
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError("Expecting one of {} but found: {}".format(BACKENDS, name))
+    if name == "jit" and not jit_available():
+        raise ValueError("The jit backend requires numba to be installed.")
+    _backend = name
+
+
+def use_jit() -> bool:
+    return _backend == "jit"
+
+
+def compile_kernel(function: Callable) -> Callable:
+    """Compile a kernel when numba is installed, otherwise return the plain Python function.
+
+    Compiled kernels release the GIL so that they can run in parallel threads.
+    """
+    if numba is None:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+def _resolve_ties_kernel(sorted_codes: np.ndarray, k: int, num_labels: int) -> int:
+    """Integer label version of KNNClassifier.resolve_ties.
+
+    Counts for the top k labels are updated as k decreases so that each step costs O(1) instead of a recount.
+    The number of labels sharing each count is tracked to detect ties.
+    """
+    k = min(k, sorted_codes.shape[0])
+    if k < 1:
+        return -1
+    counts = np.zeros(num_labels, np.int64)
+    labels_with_count = np.zeros(k + 1, np.int64)
+    for i in range(k):
+        counts[sorted_codes[i]] += 1
+    num_tied = 0
+    for code in range(num_labels):
+        if counts[code] > 0:
+            labels_with_count[counts[code]] += 1
+            if labels_with_count[counts[code]] == 2:
+                num_tied += 1
+    while num_tied > 0:
+        # Remove the k-th neighbour.
+        code = sorted_codes[k - 1]
+        count = counts[code]
+        labels_with_count[count] -= 1
+        if labels_with_count[count] == 1:
+            num_tied -= 1
+        counts[code] = count - 1
+        if count > 1:
+            labels_with_count[count - 1] += 1
+            if labels_with_count[count - 1] == 2:
+                num_tied += 1
+        k -= 1
+    return int(np.argmax(counts))
+
+
+def _interval_candidates_kernel(times: np.ndarray, valid: np.ndarray) -> np.ndarray:
+    """Flag the measurements that the loop in parse.split_into_intervals adds to some interval.
+
+    Invalid measurements and repeated times are skipped in the same way for any interval duration and maximum gap,
+    so these flags can be computed once per series.  Like the loop, a step back in time does not update the time
+    used to detect repeats.
+    """
+    n = times.shape[0]
+    candidate = np.zeros(n, np.bool_)
+    started = False
+    last_time = 0
+    previous_time = 0
+    for i in range(n):
+        t = times[i]
+        if not valid[i]:
+            previous_time = t
+            continue
+        if not started:
+            started = True
+            candidate[i] = True
+            last_time = t
+            previous_time = t
+            continue
+        if previous_time == t:
+            continue
+        candidate[i] = True
+        if t >= last_time:
+            previous_time = t
+        last_time = t
+    return candidate
+
+
+def _split_gaps_into_intervals_kernel(
+    gaps: np.ndarray,
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """The loop of parse.split_into_intervals over the time gaps between consecutive candidate measurements.
+
+    Returns the candidate interval number of each candidate, a flag for each candidate interval that is kept and
+    the index of a candidate whose time failed to increase (or -1).
+    """
+    n = gaps.shape[0] + 1
+    assignment = np.zeros(n, np.int64)
+    kept = np.zeros(n + 1, np.bool_)
+    current = 0
+    time_in_interval = 0
+    for i in range(1, n):
+        time_gap = gaps[i - 1]
+        if time_gap == 0:
+            return assignment, kept, i
+        # A step back in time indicates the start of a new measurement period.
+        if time_gap < 0:
+            if interval_duration_in_nanoseconds - time_in_interval < maximum_gap_in_nanoseconds:
+                kept[current] = True
+            current += 1
+            time_in_interval = 0
+        else:
+            time_in_interval += time_gap
+            if time_in_interval <= interval_duration_in_nanoseconds and time_gap > maximum_gap_in_nanoseconds:
+                current += 1
+                time_in_interval = 0
+            elif time_in_interval > interval_duration_in_nanoseconds:
+                if interval_duration_in_nanoseconds - (time_in_interval - time_gap) <= maximum_gap_in_nanoseconds:
+                    kept[current] = True
+                current += 1
+                time_in_interval = 0
+        assignment[i] = current
+    if interval_duration_in_nanoseconds - time_in_interval <= maximum_gap_in_nanoseconds:
+        kept[current] = True
+    return assignment, kept, -1
+
+
+interval_candidates_kernel = compile_kernel(_interval_candidates_kernel)
+split_gaps_into_intervals_kernel = compile_kernel(_split_gaps_into_intervals_kernel)
+resolve_ties_kernel = compile_kernel(_resolve_ties_kernel)
+
+
+def _resolve_ties_rows_kernel(sorted_codes: np.ndarray, k: int, num_labels: int) -> np.ndarray:
+    """Resolve ties for each row of a 2-D array of neighbour label codes."""
+    out = np.empty(sorted_codes.shape[0], np.int64)
+    for i in range(sorted_codes.shape[0]):
+        out[i] = resolve_ties_kernel(sorted_codes[i], k, num_labels)
+    return out
+
+
+resolve_ties_rows_kernel = compile_kernel(_resolve_ties_rows_kernel)
+
+
+def kept_interval_members(assignment: np.ndarray, kept: np.ndarray) -> Tuple[np.ndarray]:
+    """Indices of the measurements in each kept interval from the output of split_gaps_into_intervals_kernel."""
+    members = np.flatnonzero((assignment >= 0) & kept[assignment])
+    if len(members) == 0:
+        return ()
+    starts = np.flatnonzero(np.diff(assignment[members])) + 1
+    return tuple(np.split(members, starts))
+
+
+def interval_gaps(times: np.ndarray, valid: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Indices of the measurements of a series that can join an interval and the time gaps between them.
+
+    These do not depend on the interval duration or maximum gap so they are computed once per series and passed
+    to interval_members for each setting.
+    """
+    if times.shape[0] < 2:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    candidates = np.flatnonzero(interval_candidates_kernel(times, valid))
+    return candidates, np.diff(times[candidates])
+
+
+def interval_members(
+    candidates: np.ndarray,
+    gaps: np.ndarray,
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+) -> Tuple[np.ndarray]:
+    """Indices of the measurements in each interval of a series, from the output of interval_gaps."""
+    if candidates.shape[0] == 0:
+        return ()
+    assignment, kept, error_index = split_gaps_into_intervals_kernel(
+        gaps, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds
+    )
+    if error_index >= 0:
+        raise ValueError("Expecting time to increase but found a repeated time at index {}".format(
+            candidates[error_index]
+        ))
+    return tuple(candidates[members] for members in kept_interval_members(assignment, kept))
+
+
+def split_into_intervals(
+    data: Sequence[Tuple[int, str, int, float, float, float]],
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+) -> Tuple[Tuple[Tuple[int, str, int, float, float, float]]]:
+    """Kernel backed equivalent of parse.split_into_intervals (without the id and activity checks)."""
+    if len(data) < 2:
+        return ()
+    times = np.array([v[2] for v in data], dtype=np.int64)
+    values = np.array([v[2:] for v in data], dtype=np.float64)
+    candidates, gaps = interval_gaps(times, np.any(values != 0, axis=1))
+    members = interval_members(candidates, gaps, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds)
+    return tuple(tuple(data[i] for i in indices) for indices in members)
+
+
+def resolve_ties(sorted_codes: np.ndarray, k: int, num_labels: int) -> int:
+    """Pick the most frequent label code in the top k, decrementing k while there are tied counts."""
+    code = resolve_ties_kernel(np.ascontiguousarray(sorted_codes, dtype=np.int64), k, num_labels)
+    if code < 0:
+        raise ValueError("Expecting at least one neighbour but found k = {}".format(k))
+    return code
+
+
+def resolve_ties_rows(sorted_codes: np.ndarray, k: int, num_labels: int) -> np.ndarray:
+    """Resolve ties for each row of neighbour label codes, nearest neighbour first in each row."""
+    out = resolve_ties_rows_kernel(np.ascontiguousarray(sorted_codes, dtype=np.int64), k, num_labels)
+    if np.any(out < 0):
+        raise ValueError("Expecting at least one neighbour but found k = {}".format(k))
+    return out
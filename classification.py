@@ -1,9 +1,28 @@
 import numpy as np
+import time
+from concurrent.futures import ThreadPoolExecutor
 from itertools import chain
-from typing import Sequence, Tuple, Dict, List, Set
+from typing import Sequence, Tuple, Dict, List, Set, Union, Optional
 
+import accelerate
 import parse
 import features
+import spatial
+from feature_matrix import FeatureMatrix
+
+
+default_memory_budget_in_bytes = 256 * 2 ** 20
+# Peak bytes per candidate neighbour of the work arrays of KNNClassifier.exact_nearest_indices, measured with
+# tracemalloc: the block distances, the merged distances, indices, selection keys and argpartition result (8 bytes
+# each), boolean masks and numpy's temporary buffers.  Each query holds a block of training points and its previous
+# top k twice (in the merged arrays and on its own), and the queries, the (n_queries x k) result and a fixed
+# overhead of a few kilobytes per block are not counted.
+bytes_per_distance_entry = 56
+knn_index_types = ("brute", "kd_tree", "approximate")
+knn_reduction_types = ("condensed", "edited", "edited_condensed")
+default_var_smoothing = 1e-9
+default_cascade_threshold = 0.5
+gaussian_naive_bayes_block_size = 4096
 
 
 def train_test_folds(ids: List, shuffled_index_sequence: Sequence, num_folds: int) -> Sequence[Tuple[set, set]]:
@@ -20,14 +39,19 @@ def train_test_folds(ids: List, shuffled_index_sequence: Sequence, num_folds: in
     return tuple(out)
 
 
+def confusion_matrix_from_codes(actual: np.ndarray, predicted: np.ndarray, num_labels: int) -> np.ndarray:
+    """Count pairs of known and predicted label codes with a single bincount."""
+    actual = np.asarray(actual, dtype=np.int64)
+    predicted = np.asarray(predicted, dtype=np.int64)
+    counts = np.bincount(actual * num_labels + predicted, minlength=num_labels * num_labels)
+    return counts.reshape(num_labels, num_labels).astype(np.float64)
+
+
 def confusion_matrix_from_pairs(pairs: Sequence[Tuple[str, str]]) -> Tuple[np.ndarray, Sequence[str]]:
-    labels = sorted(set(chain(*pairs)))
-    matrix = np.zeros((len(labels), len(labels)))
-    for pair in pairs:
-        actual = labels.index(pair[0])
-        predicted = labels.index(pair[1])
-        matrix[actual, predicted] += 1
-    return matrix, tuple(labels)
+    encoder = parse.LabelEncoder.from_labels(chain(*pairs))
+    codes = encoder.encode(chain(*pairs)).reshape(-1, 2)
+    matrix = confusion_matrix_from_codes(codes[:, 0], codes[:, 1], len(encoder))
+    return matrix, encoder.labels
 
 
 def accuracy_from_confusion_matrix(matrix: np.ndarray) -> float:
@@ -35,20 +59,198 @@ def accuracy_from_confusion_matrix(matrix: np.ndarray) -> float:
     return float(np.sum(diagonal) / np.sum(matrix))
 
 
+def as_feature_matrix(
+        data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+        encoder: parse.LabelEncoder
+) -> FeatureMatrix:
+    """Feature matrix of new data, with activities unknown to the encoder given codes after its own."""
+    if isinstance(data, FeatureMatrix):
+        return data
+    return FeatureMatrix.from_dict(data, activities=encoder.extended_with(k[1] for k in data.keys()))
+
+
+def known_codes_and_encoder(matrix: FeatureMatrix, encoder: parse.LabelEncoder
+                            ) -> Tuple[np.ndarray, parse.LabelEncoder]:
+    """Known activity codes of a matrix in the codes of an encoder extended with the activities it has not seen.
+
+    Test data may contain activities missing from the training data; these are counted as misclassified in
+    confusion matrices of the size of the extended encoder instead of raising.
+    """
+    extended = encoder.extended_with(matrix.activities)
+    return matrix.activity_codes_for(extended), extended
+
+
+def knn_reduction_report(
+        train: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+        test: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+        k: int,
+        reduction: str,
+        **options
+) -> Dict[str, float]:
+    """Compare a KNNClassifier with and without prototype reduction of its training set on test data."""
+    full = KNNClassifier(train, **options)
+    reduced = KNNClassifier(train, encoder=full.encoder, reduction=reduction, **options)
+    test = as_feature_matrix(test, full.encoder)
+    num_labels = len(full.encoder.extended_with(test.activities))
+    accuracy = accuracy_from_confusion_matrix(confusion_matrix_from_codes(
+        *full.predicted_and_labeled_codes(test, k), num_labels))
+    reduced_accuracy = accuracy_from_confusion_matrix(confusion_matrix_from_codes(
+        *reduced.predicted_and_labeled_codes(test, k), num_labels))
+    return {
+        "reduction_ratio": reduced.reduction_ratio,
+        "accuracy": accuracy,
+        "reduced_accuracy": reduced_accuracy,
+        "accuracy_change": reduced_accuracy - accuracy,
+    }
+
+
 class GaussianNaiveBayesClassifier:
     """Naive Bayes classifier that assumes an underlying Gaussian distribution for each feature."""
     def __init__(
         self,
-        data: Dict[Tuple[int, str], Sequence[Sequence[float]]],
-        activities: set
+        data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+        activities: Union[set, parse.LabelEncoder],
+        var_smoothing: float = default_var_smoothing
     ) -> None:
         self.activities = activities
-        self.activity_feature_means_vars = GaussianNaiveBayesClassifier.feature_means_and_variances(
-            data, activities
-        )
-        self.p_activities = GaussianNaiveBayesClassifier.estimate_activity_probabilities(
-            data, activities
+        self.var_smoothing = var_smoothing
+        if isinstance(activities, parse.LabelEncoder):
+            self.encoder = activities
+        else:
+            self.encoder = parse.LabelEncoder.from_labels(activities)
+        if isinstance(data, FeatureMatrix):
+            self.activity_feature_means_vars = GaussianNaiveBayesClassifier.matrix_feature_means_and_variances(
+                data, activities
+            )
+            self.p_activities = GaussianNaiveBayesClassifier.matrix_activity_probabilities(data, activities)
+            self.class_counts = np.array([len(data.activity_rows(a)) for a in self.encoder], dtype=np.int64)
+        else:
+            self.activity_feature_means_vars = GaussianNaiveBayesClassifier.feature_means_and_variances(
+                data, activities
+            )
+            self.p_activities = GaussianNaiveBayesClassifier.estimate_activity_probabilities(
+                data, activities
+            )
+            self.class_counts = np.array([
+                sum(len(v) for v in parse.collect_dict_values_by_key_content(data, activity).values())
+                for activity in self.encoder
+            ], dtype=np.int64)
+        self.fit_log_space_parameters()
+
+    @staticmethod
+    def from_statistics(
+        activities: Union[set, parse.LabelEncoder],
+        class_counts: np.ndarray,
+        class_means: np.ndarray,
+        class_variances: np.ndarray,
+        var_smoothing: float = default_var_smoothing
+    ) -> 'GaussianNaiveBayesClassifier':
+        """Classifier built from per-class counts, means and (population) variances in the order of the encoder.
+
+        Starting from zero counts and calling partial_fit trains a model on a stream of batches.
+        """
+        classifier = GaussianNaiveBayesClassifier.__new__(GaussianNaiveBayesClassifier)
+        classifier.activities = activities
+        classifier.var_smoothing = var_smoothing
+        if isinstance(activities, parse.LabelEncoder):
+            classifier.encoder = activities
+        else:
+            classifier.encoder = parse.LabelEncoder.from_labels(activities)
+        classifier.set_statistics(class_counts, class_means, class_variances)
+        return classifier
+
+    def set_statistics(self, class_counts: np.ndarray, class_means: np.ndarray, class_variances: np.ndarray) -> None:
+        """Replace the model parameters with per-class counts, means and variances."""
+        self.class_counts = np.asarray(class_counts, dtype=np.int64)
+        class_means = np.asarray(class_means, dtype=np.float64)
+        class_variances = np.asarray(class_variances, dtype=np.float64)
+        if class_means.shape != class_variances.shape or class_means.shape[:1] != (len(self.encoder),) or \
+                self.class_counts.shape != (len(self.encoder),):
+            raise ValueError("Expecting statistics for {} activities but found shapes: {}, {}, {}".format(
+                len(self.encoder), self.class_counts.shape, class_means.shape, class_variances.shape
+            ))
+        total_count = int(np.sum(self.class_counts))
+        self.p_activities = {
+            activity: self.class_counts[code] / total_count if total_count > 0 else 0.0
+            for code, activity in enumerate(self.encoder)
+        }
+        self.activity_feature_means_vars = {
+            activity: [(float(m), float(v)) for m, v in zip(class_means[code], class_variances[code])]
+            for code, activity in enumerate(self.encoder)
+        }
+        self.fit_log_space_parameters()
+
+    def partial_fit(self, data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix]) -> None:
+        """Update the model with a new batch of feature vectors without revisiting earlier data.
+
+        Per-class statistics of the batch are merged with Chan's parallel update, which gives the same means and
+        variances as fitting all data at once without the cancellation of sums of squares.
+        """
+        matrix = as_feature_matrix(data, self.encoder)
+        batch = GaussianNaiveBayesClassifier.class_statistics(
+            matrix.values, matrix.activity_codes_for(self.encoder), len(self.encoder)
         )
+        current = (self.class_counts, self.class_means, self.class_variances)
+        self.set_statistics(*GaussianNaiveBayesClassifier.merge_statistics(current, batch))
+
+    @staticmethod
+    def class_statistics(values: np.ndarray, codes: np.ndarray, num_labels: int
+                         ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Count, mean and population variance of the feature values of each label code."""
+        values = np.asarray(values, dtype=np.float64).reshape(len(codes), -1)
+        counts = np.bincount(codes, minlength=num_labels).astype(np.int64)
+        means = np.zeros((num_labels, values.shape[1]))
+        variances = np.zeros((num_labels, values.shape[1]))
+        for code in np.flatnonzero(counts):
+            rows = values[codes == code]
+            means[code] = np.mean(rows, axis=0)
+            variances[code] = np.var(rows, axis=0)
+        return counts, means, variances
+
+    @staticmethod
+    def merge_statistics(
+        a: Tuple[np.ndarray, np.ndarray, np.ndarray],
+        b: Tuple[np.ndarray, np.ndarray, np.ndarray]
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Combine per-class (counts, means, variances) of two disjoint sets of feature vectors (Chan et al.)."""
+        count_a, mean_a, variance_a = a
+        count_b, mean_b, variance_b = b
+        count = count_a + count_b
+        safe_count = np.maximum(count, 1)[:, np.newaxis]
+        delta = mean_b - mean_a
+        mean = mean_a + delta * (count_b[:, np.newaxis] / safe_count)
+        squared_deviations = variance_a * count_a[:, np.newaxis] + variance_b * count_b[:, np.newaxis] + \
+            delta ** 2 * (count_a * count_b)[:, np.newaxis] / safe_count
+        return count, mean, squared_deviations / safe_count
+
+    def fit_log_space_parameters(self) -> None:
+        """Precompute per-class arrays (in the order of self.encoder) used to score many vectors at once.
+
+        Variances are smoothed by adding var_smoothing times the largest variance of any feature over all classes
+        (or var_smoothing itself if every feature is constant) so that no variance is zero.
+        """
+        self.log_priors = np.full(len(self.encoder), -np.inf)
+        means = []
+        variances = []
+        for code, activity in enumerate(self.encoder.labels):
+            means_vars = np.array(self.activity_feature_means_vars[activity], dtype=np.float64).reshape(-1, 2)
+            if self.p_activities[activity] > 0:
+                self.log_priors[code] = np.log(self.p_activities[activity])
+            else:
+                means_vars = np.zeros_like(means_vars)
+            means.append(means_vars[:, 0])
+            variances.append(means_vars[:, 1])
+        self.class_means = np.array(means).reshape(len(self.encoder), -1)
+        self.class_variances = np.array(variances).reshape(len(self.encoder), -1)
+        # Variance of each feature over all classes, from the per-class moments.
+        priors = np.exp(self.log_priors)[:, np.newaxis]
+        overall_mean = np.sum(priors * self.class_means, axis=0)
+        overall_variance = np.sum(priors * (self.class_variances + self.class_means ** 2), axis=0) - overall_mean ** 2
+        largest_variance = float(np.max(overall_variance)) if overall_variance.size > 0 else 0.0
+        epsilon = self.var_smoothing * largest_variance if largest_variance > 0 else self.var_smoothing
+        smoothed_variances = self.class_variances + epsilon
+        self.inverse_variances = 1 / smoothed_variances
+        self.log_coefficients = -0.5 * np.sum(np.log(2 * np.pi * smoothed_variances), axis=1)
 
     @staticmethod
     def feature_means_and_variances(
@@ -65,6 +267,17 @@ class GaussianNaiveBayesClassifier:
             out[activity] = means_and_variances
         return out
 
+    @staticmethod
+    def matrix_feature_means_and_variances(
+        matrix: FeatureMatrix,
+        activities: Set[str]
+    ) -> Dict[str, Sequence[Tuple[float, float]]]:
+        out = dict()
+        for activity in activities:
+            rows = matrix.activity_rows(activity)
+            out[activity] = [(float(m), float(v)) for m, v in zip(np.mean(rows, axis=0), np.var(rows, axis=0))]
+        return out
+
     @staticmethod
     def estimate_activity_probabilities(
         data: Dict[Tuple[int, str], Sequence[Sequence[float]]],
@@ -86,6 +299,12 @@ class GaussianNaiveBayesClassifier:
             estimate[activity] = activity_counts[activity] / total_count
         return estimate
 
+    @staticmethod
+    def matrix_activity_probabilities(matrix: FeatureMatrix, activities: set) -> Dict[str, float]:
+        counts = {activity: len(matrix.activity_rows(activity)) for activity in activities}
+        total_count = sum(counts.values())
+        return {activity: counts[activity] / total_count for activity in activities}
+
     @staticmethod
     def normal_pdf(x: float, mean: float, variance: float):
         exponent = (- (x - mean) ** 2) / (2 * variance)
@@ -122,26 +341,112 @@ class GaussianNaiveBayesClassifier:
         index: int = np.argmax(probabilities)
         return keys[index]
 
+    def joint_log_likelihood(self, x: np.ndarray) -> np.ndarray:
+        """Log prior plus log likelihood of each class (columns, in encoder order) for each row of x."""
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.class_means.shape[1])
+        out = np.empty((len(x), len(self.encoder)))
+        for start in range(0, len(x), gaussian_naive_bayes_block_size):
+            block = x[start: start + gaussian_naive_bayes_block_size]
+            squared_deviations = (block[:, np.newaxis, :] - self.class_means[np.newaxis, :, :]) ** 2
+            quadratic = np.einsum('nld,ld->nl', squared_deviations, self.inverse_variances)
+            out[start: start + len(block)] = self.log_priors + self.log_coefficients - 0.5 * quadratic
+        return out
+
+    def feature_log_densities(self, x: np.ndarray) -> np.ndarray:
+        """Log density of each feature under each class, shape (rows of x, classes, features).
+
+        Summing over any subset of features and adding self.log_priors gives the joint log likelihood of a naive
+        Bayes model restricted to those features (with the variance smoothing of the full model).
+        """
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.class_means.shape[1])
+        squared_deviations = (x[:, np.newaxis, :] - self.class_means[np.newaxis, :, :]) ** 2
+        log_normalisations = 0.5 * np.log(self.inverse_variances / (2 * np.pi))
+        return log_normalisations - 0.5 * squared_deviations * self.inverse_variances
+
+    def predict_log_proba(self, x: np.ndarray) -> np.ndarray:
+        """Log posterior probability of each class (columns, in encoder order) for an (n x d) array.
+
+        Working in log space means that products of many small densities cannot underflow to zero.
+        """
+        joint = self.joint_log_likelihood(x)
+        largest = np.max(joint, axis=1, keepdims=True)
+        return joint - (largest + np.log(np.sum(np.exp(joint - largest), axis=1, keepdims=True)))
+
+    def predict_batch(self, x: np.ndarray) -> np.ndarray:
+        """Predict activity codes for an (n x d) array of feature vectors."""
+        return np.argmax(self.joint_log_likelihood(x), axis=1)
+
+    def predict_codes(self, data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix]
+                      ) -> np.ndarray:
+        """Predict activity codes (in the codes of self.encoder) for every feature vector."""
+        return self.predict_batch(as_feature_matrix(data, self.encoder).values)
+
+    def predicted_and_labeled_codes(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given new data, return arrays of known and predicted activity codes."""
+        matrix = as_feature_matrix(data, self.encoder)
+        return known_codes_and_encoder(matrix, self.encoder)[0], self.predict_codes(matrix)
+
     def predicted_and_labeled_pairs(
             self,
-            data: Dict[Tuple[int, str], Sequence[Sequence[float]]],
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
     ) -> Sequence[Tuple[str, str]]:
         """Given new data, return pairs of predicted and known classes."""
-        pairs = []
-        for key, values in data.items():
-            for x in values:
-                predicted_label = self.predict_from_feature_vector(x)
-                known_label = key[1]
-                pairs.append((known_label, predicted_label))
-        return tuple(pairs)
+        matrix = data if isinstance(data, FeatureMatrix) else FeatureMatrix.from_dict(data)
+        predicted = self.encoder.decode(self.predict_batch(matrix.values))
+        return tuple(zip(matrix.labels(), predicted))
 
 
 class KNNClassifier:
     def __init__(
         self,
-        data: Dict[Tuple[int, str], Sequence[Tuple[float]]],
+        data: Union[Dict[Tuple[int, str], Sequence[Tuple[float]]], FeatureMatrix],
+        encoder: Optional[parse.LabelEncoder] = None,
+        index: str = "brute",
+        reduction: Optional[str] = None,
+        reduction_k: int = 3,
+        **index_options
     ) -> None:
-        self.locations, self.labels = KNNClassifier.data_dict_to_points_and_labels(data)
+        """Store the training data and build the chosen spatial index over it once.
+
+        index="kd_tree" builds an exact spatial.KDTree and index="approximate" builds a
+        spatial.RandomProjectionIndex.  Keyword options (e.g. leaf_size or num_trees) are passed to the index.
+        The training set can first be reduced to a subset of prototypes with reduction="condensed" (Hart's
+        condensed nearest neighbour), "edited" (Wilson's edited nearest neighbour using reduction_k neighbours)
+        or "edited_condensed" (editing followed by condensing).
+        """
+        if index not in knn_index_types:
+            raise ValueError("Expecting one of {} but found: {}".format(knn_index_types, index))
+        if reduction is not None and reduction not in knn_reduction_types:
+            raise ValueError("Expecting one of {} but found: {}".format(knn_reduction_types, reduction))
+        if isinstance(data, FeatureMatrix):
+            # The matrix values are used without a copy.
+            self.points = np.asarray(data.values, dtype=np.float64)
+            self.encoder = data.encoder if encoder is None else encoder
+            self.label_codes = data.activity_codes_for(self.encoder)
+        else:
+            vectors, labels = KNNClassifier.data_dict_to_points_and_labels(data)
+            num_features = len(vectors[0]) if len(vectors) > 0 else 0
+            self.points = np.asarray(vectors, dtype=np.float64).reshape(len(vectors), num_features)
+            self.encoder = parse.LabelEncoder.from_labels(labels) if encoder is None else encoder
+            self.label_codes = self.encoder.encode(labels)
+        self.squared_norms = np.einsum('ij,ij->i', self.points, self.points)
+        self.num_training_points = len(self.points)
+        if reduction in ("edited", "edited_condensed"):
+            self.keep_points(self.edited_indices(reduction_k))
+        if reduction in ("condensed", "edited_condensed"):
+            self.keep_points(self.condensed_indices())
+        self.reduction = reduction
+        self.reduction_ratio = len(self.points) / max(1, self.num_training_points)
+        self.index = index
+        if index == "kd_tree":
+            self.spatial_index = spatial.KDTree(self.points, **index_options)
+        elif index == "approximate":
+            self.spatial_index = spatial.RandomProjectionIndex(self.points, **index_options)
+        else:
+            self.spatial_index = None
 
     @staticmethod
     def data_dict_to_points_and_labels(data: Dict[Tuple[int, str], Sequence[Tuple[float]]]
@@ -155,6 +460,72 @@ class KNNClassifier:
                 labels.append(key[1])
         return tuple(feature_vectors), tuple(labels)
 
+    @property
+    def locations(self) -> np.ndarray:
+        """Training feature vectors, the rows of self.points."""
+        return self.points
+
+    @property
+    def labels(self) -> Tuple[str]:
+        """Activity of each training point, decoded from the label codes on demand."""
+        return self.encoder.decode(self.label_codes)
+
+    def keep_points(self, indices: np.ndarray) -> None:
+        """Reduce the stored training set to the given indices (before any spatial index is built)."""
+        self.label_codes = self.label_codes[indices]
+        self.points = self.points[indices]
+        self.squared_norms = self.squared_norms[indices]
+
+    def condensed_indices(self) -> np.ndarray:
+        """Hart's condensed nearest neighbour rule.
+
+        Start from one point per class and pass over the training set, adding each point that is misclassified by
+        its nearest neighbour in the stored subset, until a pass adds nothing.  The distance to and label of each
+        point's nearest stored neighbour are updated with one vector operation per added point, so finding the
+        next misclassified point does not need any distances to be recomputed.
+        """
+        if len(self.points) == 0:
+            return np.arange(0)
+        _, store = np.unique(self.label_codes, return_index=True)
+        in_store = np.zeros(len(self.points), dtype=bool)
+        in_store[store] = True
+        distances = self.squared_distances(self.points[store]).T
+        nearest_distances = np.min(distances, axis=1)
+        nearest_codes = self.label_codes[store[np.argmin(distances, axis=1)]]
+        added = list(store)
+        position = 0
+        while True:
+            misclassified = (nearest_codes != self.label_codes) & ~in_store
+            remaining = np.flatnonzero(misclassified[position:])
+            if len(remaining) == 0:
+                # Start another pass unless no point at all is misclassified.
+                remaining = np.flatnonzero(misclassified)
+                if len(remaining) == 0:
+                    break
+                position = 0
+            i = position + remaining[0]
+            added.append(i)
+            in_store[i] = True
+            distances = self.squared_distances(self.points[i])[0]
+            closer = distances < nearest_distances
+            nearest_distances[closer] = distances[closer]
+            nearest_codes[closer] = self.label_codes[i]
+            position = i + 1
+        return np.sort(np.array(added, dtype=np.int64))
+
+    def edited_indices(self, k: int = 3) -> np.ndarray:
+        """Wilson's edited nearest neighbour rule: keep points whose label agrees with a vote of their k nearest
+        other training points."""
+        if len(self.points) <= k:
+            return np.arange(len(self.points))
+        neighbours = self.exact_nearest_indices(self.points, k + 1)
+        is_self = neighbours == np.arange(len(self.points))[:, np.newaxis]
+        # A duplicated point may push a point out of its own k + 1 nearest, in which case drop the furthest.
+        is_self[~np.any(is_self, axis=1), -1] = True
+        others = neighbours[~is_self].reshape(len(self.points), k)
+        votes = KNNClassifier.resolve_ties_rows(self.label_codes[others], k, len(self.encoder))
+        return np.flatnonzero(votes == self.label_codes)
+
     @staticmethod
     def distances_to_points(point: Sequence[float], points: Sequence[Tuple]) -> Sequence[float]:
         """Calculate L2 distance between a given point and a sequence of other points"""
@@ -169,40 +540,378 @@ class KNNClassifier:
         sorted_labels: Tuple[str] = tuple(labels[i] for i in sort_index)
         return sorted_distances, sorted_labels
 
+    @staticmethod
+    def nearest_k_indices(distances: Sequence[float], k: int) -> np.ndarray:
+        """Indices of the k smallest distances, sorted by distance and then by index.
+
+        Uses a partial selection (O(N)) rather than a full sort, and the result matches the first k entries of a
+        stable sort of all distances.
+        """
+        distances = np.asarray(distances, dtype=np.float64)
+        if k < len(distances):
+            kth_distance = distances[np.argpartition(distances, k - 1)[k - 1]]
+            candidates = np.flatnonzero(distances <= kth_distance)
+        else:
+            candidates = np.arange(len(distances))
+        return candidates[np.lexsort((candidates, distances[candidates]))][:k]
+
+    @staticmethod
+    def nearest_k_columns(distances: np.ndarray, indices: np.ndarray, k: int, num_points: int) -> np.ndarray:
+        """Columns of the k smallest (distance, index) pairs in each row, in no particular order.
+
+        The row version of nearest_k_indices: every entry closer than the k-th smallest distance is kept and entries
+        tied at that distance are kept in order of index, so the selection does not depend on how the candidate
+        neighbours were split into blocks.  Indices must be unique within a row and smaller than num_points.
+        """
+        partitioned = np.argpartition(distances, k - 1, axis=1)[:, k - 1: k]
+        kth_distances = np.take_along_axis(distances, partitioned, axis=1)
+        del partitioned
+        # Fewer than k entries are closer than the k-th distance so all of them are among the k smallest keys.
+        keys = np.where(distances <= kth_distances, indices, num_points)
+        keys[distances < kth_distances] = -1
+        return np.argpartition(keys, k - 1, axis=1)[:, :k]
+
     @staticmethod
     def resolve_ties(sorted_labels: Sequence[str], k: int) -> str:
-        """Pick the most frequent label in top k neighbours or decrement k and try again if there is a tie."""
+        """Pick the most frequent label in top k neighbours or decrement k and try again if there is a tie.
+
+        Votes are counted once and then updated as k decreases, tracking how many labels share each count.
+        """
         top_k = list(sorted_labels[:k])
-        # Get labels and corresponding counts of items.
-        counts = []
-        labels = []
-        for label in set(top_k):
-            labels.append(label)
-            counts.append(list(top_k).count(label))
-        # Check for ties
-        if len(set(counts)) == len(counts):
-            # No duplicated counts so return label corresponding to highest count.
-            return labels[int(np.argmax(counts))]
+        counts = dict()
+        for label in top_k:
+            counts[label] = counts.get(label, 0) + 1
+        labels_with_count = dict()
+        for count in counts.values():
+            labels_with_count[count] = labels_with_count.get(count, 0) + 1
+        num_tied = sum(1 for n in labels_with_count.values() if n > 1)
+        k = len(top_k)
+        while num_tied > 0:
+            # Remove the k-th neighbour's vote.
+            label = top_k[k - 1]
+            count = counts[label]
+            labels_with_count[count] -= 1
+            if labels_with_count[count] == 1:
+                num_tied -= 1
+            if count > 1:
+                counts[label] = count - 1
+                labels_with_count[count - 1] = labels_with_count.get(count - 1, 0) + 1
+                if labels_with_count[count - 1] == 2:
+                    num_tied += 1
+            else:
+                del counts[label]
+            k -= 1
+        if len(counts) == 0:
+            raise ValueError("Expecting at least one neighbour but found k = {}".format(k))
+        return max(counts, key=counts.get)
+
+    @staticmethod
+    def resolve_ties_rows(sorted_codes: np.ndarray, k: int, num_labels: int) -> np.ndarray:
+        """Apply resolve_ties to each row of a 2-D array of neighbour label codes."""
+        if accelerate.use_jit():
+            return accelerate.resolve_ties_rows(sorted_codes, k, num_labels)
+        return np.array([KNNClassifier.resolve_ties(row, k) for row in sorted_codes.tolist()], dtype=np.int64)
+
+    def squared_distances(self, queries: np.ndarray, start: int = 0, stop: Optional[int] = None) -> np.ndarray:
+        """Squared L2 distances from each query (row) to the training points in [start, stop).
+
+        Uses |a|^2 + |b|^2 - 2 a.b so that the only large computation is one matrix product with the training
+        matrix, whose squared norms are cached at construction time.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        out = queries @ self.points[start:stop].T
+        out *= -2
+        out += np.einsum('ij,ij->i', queries, queries)[:, np.newaxis]
+        out += self.squared_norms[np.newaxis, start:stop]
+        # Rounding can make distances between (near) identical points slightly negative.
+        return np.maximum(out, 0, out=out)
+
+    def block_sizes(self, num_queries: int, k: int, memory_budget_in_bytes: int) -> Tuple[int, int]:
+        """Query and training block sizes that keep the distance work arrays within a memory budget.
+
+        Each query needs training_block + 2 k entries of bytes_per_distance_entry.  A budget smaller than the work
+        arrays of one query with one training point cannot be met and gives blocks of that size.
+        """
+        num_training = max(1, len(self.points))
+        entries = max(1, memory_budget_in_bytes // bytes_per_distance_entry)
+        if num_training + 2 * k <= entries:
+            training_block = num_training
+            query_block = entries // (num_training + 2 * k)
         else:
-            # Decrease k and try again.
-            return KNNClassifier.resolve_ties(sorted_labels, k - 1)
+            query_block = max(1, min(int(np.sqrt(entries)), entries // (2 * k + 1)))
+            training_block = max(1, entries // query_block - 2 * k)
+        return max(1, min(query_block, num_queries)), training_block
+
+    def nearest_indices(self, queries: np.ndarray, k: int,
+                        memory_budget_in_bytes: int = default_memory_budget_in_bytes) -> np.ndarray:
+        """Indices of the k nearest training points for each query, nearest first.
+
+        Without a spatial index, queries are processed in blocks and only a running top k per query is kept across
+        blocks of the training set so that peak memory is set by the budget rather than by the number of queries
+        or training points.  Equal distances are ordered by training index.  The memory budget is not needed with a
+        spatial index.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        if self.spatial_index is None:
+            return self.exact_nearest_indices(queries, k, memory_budget_in_bytes)
+        out = self.spatial_index.query(queries, k)[1]
+        # An approximate search can find fewer than k candidates, in which case fall back to an exact search.
+        incomplete = np.any(out == len(self.points), axis=1)
+        if np.any(incomplete):
+            out[incomplete] = self.exact_nearest_indices(queries[incomplete], k, memory_budget_in_bytes)
+        return out
+
+    def exact_nearest_indices(self, queries: np.ndarray, k: int,
+                              memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+                              exclude_self: bool = False) -> np.ndarray:
+        """Brute force version of nearest_indices that ignores any spatial index.
+
+        With exclude_self the queries must be the training points themselves and each point's distance to itself
+        is left out (duplicates of a point at other indices are still neighbours).
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        if exclude_self and len(queries) != len(self.points):
+            raise ValueError("Expecting the {} training points as queries but found {} queries".format(
+                len(self.points), len(queries)))
+        k = min(k, len(self.points) - 1 if exclude_self else len(self.points))
+        query_block, training_block = self.block_sizes(len(queries), k, memory_budget_in_bytes)
+        out = np.empty((len(queries), k), dtype=np.int64)
+        for q_start in range(0, len(queries), query_block):
+            block = queries[q_start: q_start + query_block]
+            best_distances = np.empty((len(block), 0))
+            best_indices = np.empty((len(block), 0), dtype=np.int64)
+            for t_start in range(0, len(self.points), training_block):
+                t_stop = min(t_start + training_block, len(self.points))
+                block_distances = self.squared_distances(block, t_start, t_stop)
+                if exclude_self:
+                    # Query q_start + j is training point q_start + j.
+                    own = np.arange(max(q_start, t_start), min(q_start + len(block), t_stop))
+                    block_distances[own - q_start, own - t_start] = np.inf
+                distances = np.concatenate([best_distances, block_distances], axis=1)
+                indices = np.concatenate([
+                    best_indices, np.broadcast_to(np.arange(t_start, t_stop), (len(block), t_stop - t_start))
+                ], axis=1)
+                if distances.shape[1] > k:
+                    keep = KNNClassifier.nearest_k_columns(distances, indices, k, len(self.points))
+                    distances = np.take_along_axis(distances, keep, axis=1)
+                    indices = np.take_along_axis(indices, keep, axis=1)
+                best_distances, best_indices = distances, indices
+            rows = np.arange(len(block))[:, np.newaxis]
+            order = np.lexsort((best_indices, best_distances), axis=1)
+            out[q_start: q_start + len(block)] = best_indices[rows, order]
+        return out
+
+    def measured_recall(self, queries: np.ndarray, k: int) -> float:
+        """Fraction of the exact k nearest neighbours of held out queries that are found by nearest_indices."""
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        return spatial.recall(self.nearest_indices(queries, k), self.exact_nearest_indices(queries, k))
+
+    def nearest_codes(self, queries: np.ndarray, k: int,
+                      memory_budget_in_bytes: int = default_memory_budget_in_bytes) -> np.ndarray:
+        """Label codes of the k nearest training points for each query, nearest first."""
+        return self.label_codes[self.nearest_indices(queries, k, memory_budget_in_bytes)]
+
+    def predict_batch(self, queries: np.ndarray, k: int,
+                      memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+                      num_workers: int = 1) -> np.ndarray:
+        """Predict activity codes for an (n_queries x d) array of feature vectors.
+
+        Gives the same predictions as predict_code_from_feature_vector: training points at equal distances from a
+        query are ordered by index, for any memory budget.  Only distances that are equal to within rounding may be
+        ordered differently, as the two methods compute distances differently.  With num_workers > 1 the
+        queries are split into contiguous slices that are handled by a thread pool.  The threads share the
+        read-only training arrays and the memory budget is divided between them.  NumPy and the compiled kernels
+        release the GIL so throughput scales with the number of cores.
+        """
+        queries = np.asarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        num_workers = max(1, min(num_workers, len(queries)))
+        if num_workers == 1:
+            sorted_codes = self.nearest_codes(queries, k, memory_budget_in_bytes)
+            return KNNClassifier.resolve_ties_rows(sorted_codes, k, len(self.encoder))
+        bounds = np.linspace(0, len(queries), num_workers + 1).astype(int)
+        worker_budget = max(1, memory_budget_in_bytes // num_workers)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(
+                lambda i: self.predict_batch(queries[bounds[i]: bounds[i + 1]], k, worker_budget),
+                range(num_workers)
+            )
+            return np.concatenate(list(results))
+
+    def predict_code_from_feature_vector(self, x: Sequence[float], k: int) -> int:
+        """Predict activity code given a feature vector."""
+        if self.spatial_index is not None:
+            sorted_codes = self.label_codes[self.nearest_indices(x, k)[0]]
+        else:
+            distances = KNNClassifier.distances_to_points(x, self.points)
+            sorted_codes = self.label_codes[KNNClassifier.nearest_k_indices(distances, k)]
+        if accelerate.use_jit():
+            return accelerate.resolve_ties(sorted_codes, k, len(self.encoder))
+        return KNNClassifier.resolve_ties(sorted_codes.tolist(), k)
 
     def predict_from_feature_vector(self, x: Sequence[float], k: int) -> str:
         """Predict activity given a feature vector."""
-        distances = KNNClassifier.distances_to_points(x, self.locations)
-        _, sorted_labels = KNNClassifier.sort_distances_and_labels(distances, self.labels)
-        return KNNClassifier.resolve_ties(sorted_labels, k)
+        return self.encoder.labels[self.predict_code_from_feature_vector(x, k)]
+
+    def predict_codes(self, data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix], k: int,
+                      memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+                      num_workers: int = 1) -> np.ndarray:
+        """Predict activity codes (in the codes of self.encoder) for every feature vector."""
+        values = as_feature_matrix(data, self.encoder).values
+        return self.predict_batch(values, k, memory_budget_in_bytes, num_workers)
+
+    def predicted_and_labeled_codes(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            k: int,
+            memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+            num_workers: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given new data, return arrays of known and predicted activity codes."""
+        matrix = as_feature_matrix(data, self.encoder)
+        predicted = self.predict_codes(matrix, k, memory_budget_in_bytes, num_workers)
+        return known_codes_and_encoder(matrix, self.encoder)[0], predicted
 
     def predicted_and_labeled_pairs(
             self,
-            data: Dict[Tuple[int, str], Sequence[Sequence[float]]],
-            k: int
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            k: int,
+            memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+            num_workers: int = 1
     ) -> Sequence[Tuple[str, str]]:
         """Given new data, return pairs of predicted and known classes."""
-        pairs = []
-        for key, values in data.items():
-            for x in values:
-                predicted_label = self.predict_from_feature_vector(x, k)
-                known_label = key[1]
-                pairs.append((known_label, predicted_label))
-        return tuple(pairs)
+        matrix = data if isinstance(data, FeatureMatrix) else FeatureMatrix.from_dict(data)
+        predicted = self.encoder.decode(self.predict_batch(matrix.values, k, memory_budget_in_bytes, num_workers))
+        return tuple(zip(matrix.labels(), predicted))
+
+    def k_sweep(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            k_max: int,
+            memory_budget_in_bytes: int = default_memory_budget_in_bytes
+    ) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Predicted activity codes and confusion matrix for every k from 1 to k_max.
+
+        Neighbours are ranked once up to k_max and the predictions for each k are read from that ranking with the
+        same tie resolution as predict_batch, so a sweep costs about the same as a single prediction pass.
+        """
+        matrix = as_feature_matrix(data, self.encoder)
+        actual, encoder = known_codes_and_encoder(matrix, self.encoder)
+        sorted_codes = self.nearest_codes(matrix.values, k_max, memory_budget_in_bytes)
+        out = dict()
+        for k in range(1, k_max + 1):
+            predicted = KNNClassifier.resolve_ties_rows(sorted_codes[:, :k], k, len(self.encoder))
+            out[k] = predicted, confusion_matrix_from_codes(actual, predicted, len(encoder))
+        return out
+
+    def leave_one_out_codes(self, k: int, memory_budget_in_bytes: int = default_memory_budget_in_bytes
+                            ) -> Tuple[np.ndarray, np.ndarray]:
+        """Known and leave-one-out predicted activity codes for every training point.
+
+        Each point is classified by the other training points in a single blocked pass over the self-distances,
+        without rebuilding the classifier for each point.  Peak memory is bounded by the budget.
+        """
+        neighbours = self.exact_nearest_indices(self.points, k, memory_budget_in_bytes, exclude_self=True)
+        predicted = KNNClassifier.resolve_ties_rows(self.label_codes[neighbours], k, len(self.encoder))
+        return self.label_codes, predicted
+
+
+class CascadeClassifier:
+    """Gaussian naive Bayes first, falling back to KNN only for feature vectors where naive Bayes is uncertain.
+
+    A vector is escalated to KNN when the difference between the two largest naive Bayes posterior probabilities
+    is below the threshold.  A threshold of 0 never escalates and a threshold above 1 always does.
+    """
+    def __init__(
+        self,
+        data: Union[Dict[Tuple[int, str], Sequence[Tuple[float]]], FeatureMatrix],
+        k: int,
+        threshold: float = default_cascade_threshold,
+        encoder: Optional[parse.LabelEncoder] = None,
+        **knn_options
+    ) -> None:
+        self.k = k
+        self.threshold = threshold
+        self.knn = KNNClassifier(data, encoder, **knn_options)
+        self.encoder = self.knn.encoder
+        self.naive_bayes = GaussianNaiveBayesClassifier(data, self.encoder)
+
+    def posterior_margins(self, x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Naive Bayes activity codes and the margin between the two most probable classes for each row of x."""
+        log_proba = self.naive_bayes.predict_log_proba(x)
+        if log_proba.shape[1] < 2:
+            return np.zeros(len(log_proba), dtype=np.int64), np.ones(len(log_proba))
+        top_two = np.exp(-np.partition(-log_proba, 1, axis=1)[:, :2])
+        return np.argmax(log_proba, axis=1), top_two[:, 0] - top_two[:, 1]
+
+    def predict_batch_and_escalations(
+        self,
+        x: np.ndarray,
+        threshold: Optional[float] = None,
+        memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+        num_workers: int = 1
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Predicted activity codes and a mask of the rows that were escalated to KNN."""
+        threshold = self.threshold if threshold is None else threshold
+        x = np.asarray(x, dtype=np.float64).reshape(-1, self.knn.points.shape[1])
+        predicted, margins = self.posterior_margins(x)
+        escalated = margins < threshold
+        if np.any(escalated):
+            predicted[escalated] = self.knn.predict_batch(x[escalated], self.k, memory_budget_in_bytes, num_workers)
+        return predicted, escalated
+
+    def predict_batch(
+        self,
+        x: np.ndarray,
+        threshold: Optional[float] = None,
+        memory_budget_in_bytes: int = default_memory_budget_in_bytes,
+        num_workers: int = 1
+    ) -> np.ndarray:
+        """Predict activity codes for an (n x d) array of feature vectors."""
+        return self.predict_batch_and_escalations(x, threshold, memory_budget_in_bytes, num_workers)[0]
+
+    def predict_codes(self, data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+                      threshold: Optional[float] = None) -> np.ndarray:
+        """Predict activity codes (in the codes of self.encoder) for every feature vector."""
+        return self.predict_batch(as_feature_matrix(data, self.encoder).values, threshold)
+
+    def predicted_and_labeled_codes(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            threshold: Optional[float] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Given new data, return arrays of known and predicted activity codes."""
+        matrix = as_feature_matrix(data, self.encoder)
+        return known_codes_and_encoder(matrix, self.encoder)[0], self.predict_codes(matrix, threshold)
+
+    def predicted_and_labeled_pairs(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            threshold: Optional[float] = None
+    ) -> Sequence[Tuple[str, str]]:
+        """Given new data, return pairs of predicted and known classes."""
+        matrix = data if isinstance(data, FeatureMatrix) else FeatureMatrix.from_dict(data)
+        predicted = self.encoder.decode(self.predict_batch(matrix.values, threshold))
+        return tuple(zip(matrix.labels(), predicted))
+
+    def operating_points(
+            self,
+            data: Union[Dict[Tuple[int, str], Sequence[Sequence[float]]], FeatureMatrix],
+            thresholds: Sequence[float]
+    ) -> Sequence[Dict[str, float]]:
+        """Fraction of escalated vectors, accuracy and mean latency per vector of a batch for each threshold."""
+        matrix = as_feature_matrix(data, self.encoder)
+        actual, encoder = known_codes_and_encoder(matrix, self.encoder)
+        out = []
+        for threshold in thresholds:
+            start = time.perf_counter()
+            predicted, escalated = self.predict_batch_and_escalations(matrix.values, threshold)
+            elapsed = time.perf_counter() - start
+            out.append({
+                "threshold": threshold,
+                "escalation_fraction": float(np.mean(escalated)) if len(matrix) > 0 else 0.0,
+                "accuracy": accuracy_from_confusion_matrix(
+                    confusion_matrix_from_codes(actual, predicted, len(encoder))
+                ),
+                "seconds_per_vector": elapsed / max(len(matrix), 1),
+            })
+        return tuple(out)
@@ -0,0 +1,188 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from typing import Sequence, Tuple, Iterable, Optional, Callable, Dict, Any, Union
+
+import parse
+import shared
+from classification import (
+    GaussianNaiveBayesClassifier, KNNClassifier, confusion_matrix_from_codes, accuracy_from_confusion_matrix,
+    default_var_smoothing, default_memory_budget_in_bytes
+)
+from feature_matrix import FeatureMatrix
+
+
+def leave_one_user_out_folds(users: Iterable[int]) -> Sequence[Tuple[set, set]]:
+    """Train and test user ids with one fold per user, in the format of classification.train_test_folds."""
+    users = tuple(users)
+    return tuple((set(users) - {user}, {user}) for user in users)
+
+
+def subtract_statistics(
+    total: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    part: Tuple[np.ndarray, np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Per-class (counts, means, variances) of the feature vectors in total that are not in part.
+
+    This inverts GaussianNaiveBayesClassifier.merge_statistics.  Variances are clipped at zero to remove round off.
+    """
+    count, mean, variance = total
+    count_b, mean_b, variance_b = part
+    count_a = count - count_b
+    if np.any(count_a < 0):
+        raise ValueError("Expecting part to be a subset of total but found counts: {} and {}".format(count, count_b))
+    safe_count_a = np.maximum(count_a, 1)[:, np.newaxis]
+    mean_a = (mean * count[:, np.newaxis] - mean_b * count_b[:, np.newaxis]) / safe_count_a
+    delta = mean_b - mean_a
+    squared_deviations = variance * count[:, np.newaxis] - variance_b * count_b[:, np.newaxis] - \
+        delta ** 2 * (count_a * count_b)[:, np.newaxis] / np.maximum(count, 1)[:, np.newaxis]
+    empty = count_a == 0
+    mean_a[empty] = 0
+    squared_deviations[empty] = 0
+    return count_a, mean_a, np.maximum(squared_deviations / safe_count_a, 0)
+
+
+class UserStatistics:
+    """Per-user, per-class sufficient statistics (counts, means and variances) of a FeatureMatrix.
+
+    The statistics are computed in one pass over the data.  The Gaussian naive Bayes model of any fold is then
+    derived by removing the statistics of the held out users from the totals, which costs O(classes x features)
+    instead of a scan over the training data.  Means and variances are used instead of raw sums of squares so
+    that large feature offsets do not cancel.
+    """
+    def __init__(self, matrix: FeatureMatrix, encoder: Optional[parse.LabelEncoder] = None) -> None:
+        self.matrix = matrix
+        self.encoder = matrix.encoder if encoder is None else encoder
+        self.activity_codes = matrix.activity_codes_for(self.encoder)
+        order = np.argsort(matrix.user_codes, kind="stable")
+        bounds = np.searchsorted(matrix.user_codes[order], np.arange(len(matrix.users) + 1))
+        self.user_rows = tuple(order[bounds[i]: bounds[i + 1]] for i in range(len(matrix.users)))
+        self.user_index = {u: i for i, u in enumerate(matrix.users)}
+        self.user_statistics = tuple(
+            GaussianNaiveBayesClassifier.class_statistics(
+                matrix.values[rows], self.activity_codes[rows], len(self.encoder)
+            )
+            for rows in self.user_rows
+        )
+        empty = (
+            np.zeros(len(self.encoder), dtype=np.int64),
+            np.zeros((len(self.encoder), matrix.num_features)),
+            np.zeros((len(self.encoder), matrix.num_features)),
+        )
+        self.total = reduce(GaussianNaiveBayesClassifier.merge_statistics, self.user_statistics, empty)
+        self.empty = empty
+
+    def statistics_of(self, users: Iterable[int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Combined statistics of the given users (users without data are ignored)."""
+        parts = [self.user_statistics[self.user_index[u]] for u in users if u in self.user_index]
+        return reduce(GaussianNaiveBayesClassifier.merge_statistics, parts, self.empty)
+
+    def rows_of(self, users: Iterable[int]) -> np.ndarray:
+        """Row indices of the matrix belonging to the given users."""
+        rows = [self.user_rows[self.user_index[u]] for u in users if u in self.user_index]
+        return np.sort(np.concatenate(rows)) if len(rows) > 0 else np.empty(0, dtype=np.int64)
+
+    def classifier_without(self, users: Iterable[int], var_smoothing: float = default_var_smoothing
+                           ) -> GaussianNaiveBayesClassifier:
+        """Naive Bayes classifier trained on every user except the given users."""
+        statistics = subtract_statistics(self.total, self.statistics_of(users))
+        return GaussianNaiveBayesClassifier.from_statistics(self.encoder, *statistics, var_smoothing=var_smoothing)
+
+    def cross_validate(
+        self,
+        folds: Optional[Sequence[Tuple[set, set]]] = None,
+        var_smoothing: float = default_var_smoothing
+    ) -> Sequence[np.ndarray]:
+        """Confusion matrix (in the codes of self.encoder) of each fold, leave one user out by default.
+
+        Only users in the test set of a fold are removed from the totals, so the training users of each fold are
+        assumed to be all other users of the matrix.
+        """
+        if folds is None:
+            folds = leave_one_user_out_folds(self.matrix.users)
+        out = []
+        for _, test_ids in folds:
+            classifier = self.classifier_without(test_ids, var_smoothing)
+            rows = self.rows_of(test_ids)
+            predicted = classifier.predict_batch(self.matrix.values[rows])
+            out.append(confusion_matrix_from_codes(self.activity_codes[rows], predicted, len(self.encoder)))
+        return tuple(out)
+
+
+def naive_bayes_factory(train: FeatureMatrix, seed: int) -> Callable[[np.ndarray], np.ndarray]:
+    """Classifier factory for run_folds: fit naive Bayes and return its batch prediction (the seed is unused)."""
+    return GaussianNaiveBayesClassifier(train, train.encoder).predict_batch
+
+
+class KNNFactory:
+    """Picklable classifier factory for run_folds that fits a KNNClassifier and predicts with k neighbours.
+
+    The fold seed is passed to the approximate index so that its random projections are reproducible.
+    """
+    def __init__(self, k: int, memory_budget_in_bytes: int = default_memory_budget_in_bytes, **classifier_options):
+        self.k = k
+        self.memory_budget_in_bytes = memory_budget_in_bytes
+        self.classifier_options = classifier_options
+
+    def __call__(self, train: FeatureMatrix, seed: int) -> Callable[[np.ndarray], np.ndarray]:
+        options = dict(self.classifier_options)
+        if options.get("index") == "approximate":
+            options.setdefault("seed", seed)
+        classifier = KNNClassifier(train, train.encoder, **options)
+        return lambda queries: classifier.predict_batch(queries, self.k, self.memory_budget_in_bytes)
+
+
+def fold_seeds(seed: int, num_folds: int) -> Sequence[int]:
+    """Independent seed for each fold spawned from one seed, independent of how folds are scheduled."""
+    return tuple(int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(num_folds))
+
+
+def run_fold(
+    matrix: Union[FeatureMatrix, shared.SharedMatrixHandle],
+    train_ids: set,
+    test_ids: set,
+    classifier_factory: Callable[[FeatureMatrix, int], Callable[[np.ndarray], np.ndarray]],
+    seed: int
+) -> np.ndarray:
+    """Fit on the training users and return the confusion matrix (in the codes of matrix.encoder) of the test users.
+
+    The factory is called with the training matrix and a seed and returns a function that maps an array of feature
+    vectors to activity codes of the training matrix's encoder.  A handle to a shared matrix is attached first.
+    """
+    if isinstance(matrix, shared.SharedMatrixHandle):
+        matrix = shared.attach(matrix)
+    train, test = matrix.split_by_users(train_ids, test_ids)
+    predicted = classifier_factory(train, seed)(test.values)
+    return confusion_matrix_from_codes(test.activity_codes, predicted, len(matrix.encoder))
+
+
+def run_folds(
+    matrix: FeatureMatrix,
+    folds: Sequence[Tuple[set, set]],
+    classifier_factory: Callable[[FeatureMatrix, int], Callable[[np.ndarray], np.ndarray]],
+    seed: int = 0,
+    num_workers: int = 1
+) -> Dict[str, Any]:
+    """Evaluate every fold, in a pool of num_workers processes when num_workers > 1.
+
+    The factory must be picklable (a module level function or an instance of a module level class such as
+    KNNFactory).  Each fold gets a seed from fold_seeds so results do not depend on the number of workers.  The
+    matrix is published once in shared memory so that workers read it without pickling a copy per fold.  Returns
+    the confusion matrix and accuracy of each fold and of all folds combined.
+    """
+    if num_workers < 1:
+        raise ValueError("Expecting at least one worker but found: {}".format(num_workers))
+    seeds = fold_seeds(seed, len(folds))
+    arguments = ([f[0] for f in folds], [f[1] for f in folds], [classifier_factory] * len(folds), seeds)
+    if num_workers == 1:
+        confusion_matrices = tuple(map(run_fold, [matrix] * len(folds), *arguments))
+    else:
+        with shared.SharedFeatureMatrix(matrix) as published, ProcessPoolExecutor(max_workers=num_workers) as executor:
+            confusion_matrices = tuple(executor.map(run_fold, [published.handle] * len(folds), *arguments))
+    total = sum(confusion_matrices, np.zeros((len(matrix.encoder), len(matrix.encoder))))
+    return {
+        "confusion_matrices": confusion_matrices,
+        "accuracies": tuple(accuracy_from_confusion_matrix(m) for m in confusion_matrices),
+        "confusion_matrix": total,
+        "accuracy": accuracy_from_confusion_matrix(total),
+    }
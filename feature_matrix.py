@@ -0,0 +1,115 @@
+import numpy as np
+from typing import Tuple, Sequence, Dict, Iterable, Optional, Union
+
+from parse import LabelEncoder
+
+
+class FeatureMatrix:
+    """Feature vectors stored as one contiguous 2-D array with parallel user, activity and interval columns.
+
+    Row i holds the feature vector of interval interval_ids[i] of the series for user users[user_codes[i]] and
+    activity activities[activity_codes[i]].  Selecting rows for a set of users is a single boolean mask.
+    Activity codes are defined by a parse.LabelEncoder which can be shared with the classifiers.
+    """
+    def __init__(
+        self,
+        values: np.ndarray,
+        user_codes: np.ndarray,
+        activity_codes: np.ndarray,
+        interval_ids: np.ndarray,
+        users: Sequence[int],
+        activities: Union[Sequence[str], LabelEncoder],
+    ) -> None:
+        self.values = np.ascontiguousarray(values, dtype=np.float64)
+        self.user_codes = np.asarray(user_codes, dtype=np.int64)
+        self.activity_codes = np.asarray(activity_codes, dtype=np.int64)
+        self.interval_ids = np.asarray(interval_ids, dtype=np.int64)
+        self.users = tuple(users)
+        self.encoder = activities if isinstance(activities, LabelEncoder) else LabelEncoder(activities)
+        self.activities = self.encoder.labels
+        if self.values.ndim != 2:
+            raise ValueError("Expecting a 2-D array of feature values but found shape: {}".format(self.values.shape))
+        num_rows = self.values.shape[0]
+        for column in (self.user_codes, self.activity_codes, self.interval_ids):
+            if column.shape != (num_rows,):
+                raise ValueError("Expecting {} codes but found shape: {}".format(num_rows, column.shape))
+
+    @staticmethod
+    def from_dict(
+        data: Dict[Tuple[int, str], Sequence[Sequence[float]]],
+        users: Optional[Iterable[int]] = None,
+        activities: Optional[Union[Iterable[str], LabelEncoder]] = None,
+    ) -> 'FeatureMatrix':
+        """Build a feature matrix from a dictionary mapping user id and activity pairs to feature vectors.
+
+        Users and activities are sorted to define their codes unless a LabelEncoder is given for the activities.
+        """
+        users = tuple(sorted(set(k[0] for k in data.keys()) if users is None else users))
+        if not isinstance(activities, LabelEncoder):
+            activities = LabelEncoder.from_labels(set(k[1] for k in data.keys()) if activities is None else activities)
+        user_index = {u: i for i, u in enumerate(users)}
+        rows = []
+        user_codes = []
+        activity_codes = []
+        interval_ids = []
+        for (user, activity), vectors in data.items():
+            rows.extend(vectors)
+            user_codes.extend([user_index[user]] * len(vectors))
+            activity_codes.extend([activities.encode_one(activity)] * len(vectors))
+            interval_ids.extend(range(len(vectors)))
+        num_features = len(rows[0]) if len(rows) > 0 else 0
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), num_features)
+        return FeatureMatrix(values, user_codes, activity_codes, interval_ids, users, activities)
+
+    def to_dict(self) -> Dict[Tuple[int, str], Tuple[Tuple[float]]]:
+        """Convert back to a dictionary mapping user id and activity pairs to feature vectors in interval order."""
+        out = dict()
+        order = np.lexsort((self.interval_ids, self.activity_codes, self.user_codes))
+        for i in order:
+            key = (self.users[self.user_codes[i]], self.activities[self.activity_codes[i]])
+            out.setdefault(key, []).append(tuple(float(v) for v in self.values[i]))
+        return {key: tuple(value) for key, value in out.items()}
+
+    def __len__(self) -> int:
+        return self.values.shape[0]
+
+    @property
+    def num_features(self) -> int:
+        return self.values.shape[1]
+
+    def labels(self) -> Tuple[str]:
+        """Activity of each row."""
+        return self.encoder.decode(self.activity_codes)
+
+    def activity_codes_for(self, encoder: LabelEncoder) -> np.ndarray:
+        """Activity code of each row expressed in the codes of another encoder."""
+        if encoder == self.encoder:
+            return self.activity_codes
+        return encoder.translation_from(self.encoder)[self.activity_codes]
+
+    def select_rows(self, mask: np.ndarray) -> 'FeatureMatrix':
+        """New feature matrix with rows selected by a boolean mask or an index array."""
+        return FeatureMatrix(
+            self.values[mask], self.user_codes[mask], self.activity_codes[mask], self.interval_ids[mask],
+            self.users, self.encoder,
+        )
+
+    def user_mask(self, users: Iterable[int]) -> np.ndarray:
+        """Boolean mask of rows belonging to any of the given user ids."""
+        user_index = {u: i for i, u in enumerate(self.users)}
+        codes = [user_index[u] for u in users if u in user_index]
+        return np.isin(self.user_codes, codes)
+
+    def select_users(self, users: Iterable[int]) -> 'FeatureMatrix':
+        return self.select_rows(self.user_mask(users))
+
+    def split_by_users(self, train_ids: Iterable[int], test_ids: Iterable[int]
+                       ) -> Tuple['FeatureMatrix', 'FeatureMatrix']:
+        """Train and test matrices for one fold produced by classification.train_test_folds."""
+        return self.select_users(train_ids), self.select_users(test_ids)
+
+    def activity_rows(self, activity: str) -> np.ndarray:
+        """Feature values for all rows of one activity."""
+        if activity not in self.activities:
+            return np.empty((0, self.num_features))
+        return self.values[self.activity_codes == self.encoder.encode_one(activity)]
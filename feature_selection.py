@@ -0,0 +1,95 @@
+import numpy as np
+from typing import Sequence, Tuple, Iterable, Optional
+
+from classification import default_var_smoothing
+from cross_validation import UserStatistics, leave_one_user_out_folds
+from feature_matrix import FeatureMatrix
+
+
+class FeatureSubsetScorer:
+    """Cross validated accuracy of Gaussian naive Bayes models on subsets of the columns of a FeatureMatrix.
+
+    Naive Bayes log likelihoods are sums over features, so the per-feature log densities of the test rows of each
+    fold are computed once and any subset is scored by summing its columns.  Compute the matrix with every candidate
+    function from features.py once, then search over column indices.  Variance smoothing is taken from the model
+    with all features, which differs from refitting on a subset only through the (tiny) smoothing constant.
+    """
+    def __init__(
+        self,
+        matrix: FeatureMatrix,
+        folds: Optional[Sequence[Tuple[set, set]]] = None,
+        var_smoothing: float = default_var_smoothing
+    ) -> None:
+        statistics = UserStatistics(matrix)
+        if folds is None:
+            folds = leave_one_user_out_folds(matrix.users)
+        self.num_features = matrix.num_features
+        self.log_priors = []
+        self.log_densities = []
+        self.codes = []
+        for _, test_ids in folds:
+            classifier = statistics.classifier_without(test_ids, var_smoothing)
+            rows = statistics.rows_of(test_ids)
+            self.log_priors.append(classifier.log_priors)
+            self.log_densities.append(classifier.feature_log_densities(matrix.values[rows]))
+            self.codes.append(statistics.activity_codes[rows])
+        self.num_rows = sum(len(codes) for codes in self.codes)
+
+    def num_correct(self, joint_log_likelihoods: Sequence[np.ndarray]) -> int:
+        return int(sum(np.sum(np.argmax(j, axis=1) == codes) for j, codes in zip(joint_log_likelihoods, self.codes)))
+
+    def partial_sums(self, subset: Iterable[int]) -> Sequence[np.ndarray]:
+        """Joint log likelihood of the test rows of each fold using the given feature columns."""
+        subset = list(subset)
+        return [priors + np.sum(densities[:, :, subset], axis=2)
+                for priors, densities in zip(self.log_priors, self.log_densities)]
+
+    def accuracy(self, subset: Iterable[int]) -> float:
+        """Accuracy pooled over the test rows of all folds."""
+        return self.num_correct(self.partial_sums(subset)) / self.num_rows
+
+    def forward_selection(self, max_features: Optional[int] = None) -> Sequence[Tuple[Tuple[int], float]]:
+        """Greedily add the feature that most improves accuracy.
+
+        Returns the selected subset and its accuracy after each step so the caller can choose where to stop.
+        """
+        max_features = self.num_features if max_features is None else min(max_features, self.num_features)
+        selected = []
+        sums = self.partial_sums(selected)
+        out = []
+        while len(selected) < max_features:
+            best_feature = None
+            best_correct = -1
+            for feature in range(self.num_features):
+                if feature in selected:
+                    continue
+                correct = self.num_correct([s + d[:, :, feature] for s, d in zip(sums, self.log_densities)])
+                if correct > best_correct:
+                    best_feature, best_correct = feature, correct
+            selected.append(best_feature)
+            sums = [s + d[:, :, best_feature] for s, d in zip(sums, self.log_densities)]
+            out.append((tuple(selected), best_correct / self.num_rows))
+        return tuple(out)
+
+    def backward_elimination(self, min_features: int = 1) -> Sequence[Tuple[Tuple[int], float]]:
+        """Starting from all features, greedily remove the feature whose removal gives the highest accuracy.
+
+        Returns the remaining subset and its accuracy after each step, starting with the full set.
+        """
+        if min_features < 1:
+            raise ValueError("Expecting min_features to be at least 1 but found: {}".format(min_features))
+        remaining = list(range(self.num_features))
+        sums = self.partial_sums(remaining)
+        out = [(tuple(remaining), self.num_correct(sums) / self.num_rows)]
+        while len(remaining) > min_features:
+            best_feature = None
+            best_correct = -1
+            for feature in remaining:
+                correct = self.num_correct([s - d[:, :, feature] for s, d in zip(sums, self.log_densities)])
+                if correct > best_correct:
+                    best_feature, best_correct = feature, correct
+            remaining.remove(best_feature)
+            # Recompute rather than subtract so that round off does not accumulate over many steps.
+            sums = self.partial_sums(remaining)
+            out.append((tuple(remaining), best_correct / self.num_rows))
+        return tuple(out)
@@ -123,3 +123,145 @@ def mean_y_acceleration(t, x) -> float:
 
 def mean_z_acceleration(t, x) -> float:
     return float(np.mean(x[2]))
+
+
+class SlidingWindowFeatures:
+    """Features of a sliding window of measurements, updated in O(1) as measurements enter and leave the window.
+
+    Measurements are held in ring buffers of fixed capacity.  Per-axis and magnitude sums, a Welford accumulator
+    for the variance of magnitudes and sums of the per-pair change rates are updated on every append and pop.
+    Methods share the names of the batch feature functions in this module and match them within floating point
+    tolerance (up to round off accumulated by the running sums).
+    """
+    def __init__(self, capacity: int) -> None:
+        if capacity < 1:
+            raise ValueError("Expecting a capacity of at least one but found: {}".format(capacity))
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.accelerations = np.zeros((3, capacity))
+        # Change rates between each measurement and the measurement before it in the window.
+        self.magnitude_rates = np.zeros(capacity)
+        self.angle_rates = np.zeros(capacity)
+        self.start = 0
+        self.length = 0
+        self.axis_sums = np.zeros(3)
+        self.magnitude_mean = 0.0
+        self.magnitude_squared_deviations = 0.0
+        self.magnitude_rate_sum = 0.0
+        self.absolute_magnitude_rate_sum = 0.0
+        self.angle_rate_sum = 0.0
+
+    def __len__(self) -> int:
+        return self.length
+
+    def position(self, i: int) -> int:
+        """Ring buffer position of the i-th measurement in the window."""
+        return (self.start + i) % self.capacity
+
+    def append(self, t: int, acceleration: Sequence[float]) -> None:
+        """Add a measurement to the end of the window."""
+        if self.length == self.capacity:
+            raise ValueError("Expecting at most {} measurements in the window".format(self.capacity))
+        i = self.position(self.length)
+        self.times[i] = t
+        self.accelerations[:, i] = acceleration
+        self.axis_sums += self.accelerations[:, i]
+        magnitude = float(np.linalg.norm(self.accelerations[:, i]))
+        self.length += 1
+        delta = magnitude - self.magnitude_mean
+        self.magnitude_mean += delta / self.length
+        self.magnitude_squared_deviations += delta * (magnitude - self.magnitude_mean)
+        if self.length > 1:
+            previous = self.position(self.length - 2)
+            seconds = (self.times[i] - self.times[previous]) / nanoseconds_in_one_second
+            magnitude_rate = (magnitude - np.linalg.norm(self.accelerations[:, previous])) / seconds
+            angle_rate = angle_between_vectors(self.accelerations[:, previous], self.accelerations[:, i]) / seconds
+            self.magnitude_rates[i] = magnitude_rate
+            self.angle_rates[i] = angle_rate
+            self.magnitude_rate_sum += magnitude_rate
+            self.absolute_magnitude_rate_sum += abs(magnitude_rate)
+            self.angle_rate_sum += angle_rate
+
+    def pop(self) -> None:
+        """Remove the oldest measurement from the window."""
+        if self.length == 0:
+            raise ValueError("Expecting a measurement in the window but found none")
+        i = self.start
+        self.axis_sums -= self.accelerations[:, i]
+        magnitude = float(np.linalg.norm(self.accelerations[:, i]))
+        self.length -= 1
+        if self.length == 0:
+            self.magnitude_mean = 0.0
+            self.magnitude_squared_deviations = 0.0
+            self.axis_sums[:] = 0.0
+        else:
+            delta = magnitude - self.magnitude_mean
+            self.magnitude_mean -= delta / self.length
+            self.magnitude_squared_deviations -= delta * (magnitude - self.magnitude_mean)
+        self.start = self.position(1)
+        if self.length > 0:
+            # The new first measurement no longer has a pair before it.
+            self.magnitude_rate_sum -= self.magnitude_rates[self.start]
+            self.absolute_magnitude_rate_sum -= abs(self.magnitude_rates[self.start])
+            self.angle_rate_sum -= self.angle_rates[self.start]
+        if self.length < 2:
+            self.magnitude_rate_sum = 0.0
+            self.absolute_magnitude_rate_sum = 0.0
+            self.angle_rate_sum = 0.0
+
+    def mean_x_acceleration(self) -> float:
+        return float(self.axis_sums[0] / self.length) if self.length > 0 else np.nan
+
+    def mean_y_acceleration(self) -> float:
+        return float(self.axis_sums[1] / self.length) if self.length > 0 else np.nan
+
+    def mean_z_acceleration(self) -> float:
+        return float(self.axis_sums[2] / self.length) if self.length > 0 else np.nan
+
+    def mean_of_magnitudes(self) -> float:
+        return self.magnitude_mean if self.length > 0 else np.nan
+
+    def variance_of_magnitudes(self) -> float:
+        return max(self.magnitude_squared_deviations / self.length, 0.0) if self.length > 0 else np.nan
+
+    def mean_magnitude_change_per_second(self) -> float:
+        return self.magnitude_rate_sum / (self.length - 1) if self.length > 1 else np.nan
+
+    def mean_absolute_magnitude_change_per_second(self) -> float:
+        return self.absolute_magnitude_rate_sum / (self.length - 1) if self.length > 1 else np.nan
+
+    def mean_angle_change_per_second(self) -> float:
+        return self.angle_rate_sum / (self.length - 1) if self.length > 1 else np.nan
+
+    def vector(self, names: Sequence[str]) -> Tuple[float]:
+        """Current values of the named features, e.g. the __name__ of batch feature functions."""
+        return tuple(getattr(self, name)() for name in names)
+
+
+def sliding_window_vectors(
+    times_in_nanoseconds: np.ndarray,
+    x: np.ndarray,
+    window_length: int,
+    hop: int,
+    feature_functions: Sequence[Callable[[np.ndarray, np.ndarray], Any]],
+) -> np.ndarray:
+    """Feature vectors of windows of window_length measurements starting every hop measurements.
+
+    Window i covers measurements [i * hop, i * hop + window_length) and gives the same values (within floating point
+    tolerance) as applying the batch feature functions to that slice, at O(hop) instead of O(window_length) cost.
+    """
+    if window_length < 1 or hop < 1:
+        raise ValueError("Expecting a positive window length and hop but found: {} and {}".format(window_length, hop))
+    names = [f.__name__ for f in feature_functions]
+    window = SlidingWindowFeatures(window_length)
+    out = []
+    end = 0
+    for start in range(0, len(times_in_nanoseconds) - window_length + 1, hop):
+        while len(window) > 0 and start > end - len(window):
+            window.pop()
+        end = max(end, start)
+        while end < start + window_length:
+            window.append(times_in_nanoseconds[end], x[:, end])
+            end += 1
+        out.append(window.vector(names))
+    return np.array(out, dtype=np.float64).reshape(len(out), len(names))
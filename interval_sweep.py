@@ -0,0 +1,159 @@
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product, repeat
+from typing import Sequence, Tuple, Dict, Callable, Any, Optional
+
+import accelerate
+import parse
+from classification import accuracy_from_confusion_matrix
+from cross_validation import UserStatistics
+from feature_matrix import FeatureMatrix
+
+
+# Times, (3 x n) accelerations, indices of the measurements that can join an interval and the gaps between them.
+Series = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def series_arrays(data: Sequence[Tuple[int, str, int, float, float, float]]) -> Dict[Tuple[int, str], Series]:
+    """Group measurements by user and activity once and convert each series to arrays.
+
+    Invalid measurements (see parse.measurement_is_valid) and repeated times are skipped and the time gaps between
+    the remaining measurements are computed here, once per series, as they do not depend on the interval duration
+    or maximum gap.
+    """
+    out = dict()
+    for key, series in parse.measurements_by_user_and_activity(data).items():
+        values = np.array([v[2:] for v in series], dtype=np.float64).reshape(len(series), 4)
+        times = np.array([v[2] for v in series], dtype=np.int64)
+        candidates, gaps = accelerate.interval_gaps(times, np.any(values != 0, axis=1))
+        out[key] = (times, np.ascontiguousarray(values[:, 1:].T), candidates, gaps)
+    return out
+
+
+def reference_interval_members(
+    key: Tuple[int, str],
+    series: Series,
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+) -> Sequence[np.ndarray]:
+    """Interval indices from parse.split_into_intervals, run on the series with each measurement's index in place
+    of the user id."""
+    times, accelerations = series[0], series[1]
+    measurements = tuple(zip(range(len(times)), repeat(key[1]), times.tolist(), *accelerations.tolist()))
+    intervals = parse.split_into_intervals(measurements, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds,
+                                           check_id=False)
+    return tuple(np.array([m[0] for m in interval], dtype=np.int64) for interval in intervals)
+
+
+def interval_indices(
+    arrays: Dict[Tuple[int, str], Series],
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+) -> Dict[Tuple[int, str], Sequence[np.ndarray]]:
+    """Indices of the measurements in each interval, the array equivalent of parse.intervals_by_user_and_activity.
+
+    With the accelerate module's python backend the original loop of parse.split_into_intervals is used instead of
+    the kernel over the precomputed gaps.
+    """
+    if not accelerate.use_jit():
+        return {
+            key: reference_interval_members(key, series, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds)
+            for key, series in arrays.items()
+        }
+    return {
+        key: accelerate.interval_members(candidates, gaps, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds)
+        for key, (_, _, candidates, gaps) in arrays.items()
+    }
+
+
+def feature_vectors(
+    arrays: Dict[Tuple[int, str], Series],
+    intervals: Dict[Tuple[int, str], Sequence[np.ndarray]],
+    feature_functions: Sequence[Callable[[np.ndarray, np.ndarray], Any]],
+) -> Dict[Tuple[int, str], Sequence[Sequence[float]]]:
+    """Array equivalent of features.vectors_for_intervals for intervals given as measurement indices.
+
+    Features of an interval with a single measurement are computed from no time differences, which gives nan for
+    the per second features as in features.vectors_for_intervals, without numpy's empty slice warnings.
+    """
+    out = dict()
+    for key, members in intervals.items():
+        times, accelerations = arrays[key][0], arrays[key][1]
+        vectors = []
+        for indices in members:
+            t = times[indices] - np.min(times[indices])
+            with warnings.catch_warnings():
+                if len(indices) < 2:
+                    warnings.simplefilter("ignore", RuntimeWarning)
+                vectors.append(tuple(f(t, accelerations[:, indices]) for f in feature_functions))
+        out[key] = tuple(vectors)
+    return out
+
+
+def naive_bayes_accuracy(matrix: FeatureMatrix) -> float:
+    """Leave one user out accuracy of Gaussian naive Bayes, used as the default downstream score of a setting."""
+    if len(matrix) == 0:
+        return float("nan")
+    return accuracy_from_confusion_matrix(sum(UserStatistics(matrix).cross_validate()))
+
+
+# Series arrays of the current sweep in each worker process, set once per worker by the pool initializer.
+_arrays: Dict[Tuple[int, str], Series] = dict()
+
+
+def _set_arrays(arrays: Dict[Tuple[int, str], Series]) -> None:
+    global _arrays
+    _arrays = arrays
+
+
+def evaluate_setting(
+    interval_duration_in_nanoseconds: int,
+    maximum_gap_in_nanoseconds: int,
+    feature_functions: Sequence[Callable[[np.ndarray, np.ndarray], Any]],
+    evaluate: Callable[[FeatureMatrix], float],
+    arrays: Optional[Dict[Tuple[int, str], Series]] = None,
+) -> Dict[str, Any]:
+    """Interval counts and downstream accuracy for one interval duration and maximum gap.
+
+    Series without any interval are left out of the feature matrix, so users and activities without data do not
+    reach the evaluation.
+    """
+    arrays = _arrays if arrays is None else arrays
+    intervals = interval_indices(arrays, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds)
+    non_empty = {key: members for key, members in intervals.items() if len(members) > 0}
+    matrix = FeatureMatrix.from_dict(feature_vectors(arrays, non_empty, feature_functions))
+    return {
+        "interval_duration_in_nanoseconds": interval_duration_in_nanoseconds,
+        "maximum_gap_in_nanoseconds": maximum_gap_in_nanoseconds,
+        "intervals_per_activity": parse.count_intervals_per_activity(intervals),
+        "intervals_per_user": parse.count_intervals_per_user(intervals),
+        "accuracy": evaluate(matrix),
+    }
+
+
+def sweep_interval_parameters(
+    data: Sequence[Tuple[int, str, int, float, float, float]],
+    interval_durations_in_nanoseconds: Sequence[int],
+    maximum_gaps_in_nanoseconds: Sequence[int],
+    feature_functions: Sequence[Callable[[np.ndarray, np.ndarray], Any]],
+    evaluate: Callable[[FeatureMatrix], float] = naive_bayes_accuracy,
+    num_workers: int = 1,
+) -> Sequence[Dict[str, Any]]:
+    """Evaluate every (duration, maximum gap) pair, parsing and grouping the measurements only once.
+
+    Settings run in a pool of num_workers processes when num_workers > 1; the series arrays are sent to each worker
+    once and feature functions and evaluate must be picklable.  Results are in the order of the grid with the
+    duration varying slowest.
+    """
+    if num_workers < 1:
+        raise ValueError("Expecting at least one worker but found: {}".format(num_workers))
+    arrays = series_arrays(data)
+    settings = tuple(product(interval_durations_in_nanoseconds, maximum_gaps_in_nanoseconds))
+    durations = [s[0] for s in settings]
+    gaps = [s[1] for s in settings]
+    repeated = ([feature_functions] * len(settings), [evaluate] * len(settings))
+    if num_workers == 1:
+        return tuple(map(evaluate_setting, durations, gaps, *repeated, [arrays] * len(settings)))
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=_set_arrays, initargs=(arrays,)) as executor:
+        return tuple(executor.map(evaluate_setting, durations, gaps, *repeated))
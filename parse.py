@@ -1,5 +1,7 @@
 import numpy as np
-from typing import Tuple, Sequence, Dict, Set, Any, Optional, Iterable
+from typing import Tuple, Sequence, Dict, Set, Any, Optional, Iterable, Iterator
+
+import accelerate
 
 
 def file_to_string(file_path: str) -> str:
@@ -39,6 +41,64 @@ def extract_activity_set(data: Iterable[Tuple[int, str, int, float, float, float
     return set(x[1] for x in data)
 
 
+class LabelEncoder:
+    """Fixed mapping between activity labels and integer codes.
+
+    The encoder is created once when the data is loaded so that classifiers, predictions and confusion matrices all
+    share the same codes.  Strings are only needed again when results are displayed.
+    """
+    def __init__(self, labels: Sequence[str]) -> None:
+        self.labels = tuple(labels)
+        if len(set(self.labels)) != len(self.labels):
+            raise ValueError("Expecting unique labels but found: {}".format(self.labels))
+        self._codes = {label: i for i, label in enumerate(self.labels)}
+
+    @staticmethod
+    def from_labels(labels: Iterable[str]) -> 'LabelEncoder':
+        """Encoder for the sorted unique labels."""
+        return LabelEncoder(sorted(set(labels)))
+
+    @staticmethod
+    def from_measurements(data: Iterable[Tuple[int, str, int, float, float, float]]) -> 'LabelEncoder':
+        return LabelEncoder.from_labels(extract_activity_set(data))
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.labels)
+
+    def __eq__(self, other: Any) -> bool:
+        return isinstance(other, LabelEncoder) and self.labels == other.labels
+
+    def __hash__(self) -> int:
+        return hash(self.labels)
+
+    def __repr__(self) -> str:
+        return "LabelEncoder({})".format(self.labels)
+
+    def encode_one(self, label: str) -> int:
+        try:
+            return self._codes[label]
+        except KeyError:
+            raise ValueError("Unknown label: {}".format(label))
+
+    def encode(self, labels: Iterable[str]) -> np.ndarray:
+        return np.array([self.encode_one(label) for label in labels], dtype=np.int64)
+
+    def decode(self, codes: Iterable[int]) -> Tuple[str]:
+        return tuple(self.labels[c] for c in codes)
+
+    def extended_with(self, labels: Iterable[str]) -> 'LabelEncoder':
+        """Encoder with the same codes followed by codes for the sorted labels it does not know yet."""
+        unseen = sorted(set(labels) - set(self.labels))
+        return LabelEncoder(self.labels + tuple(unseen)) if len(unseen) > 0 else self
+
+    def translation_from(self, other: 'LabelEncoder') -> np.ndarray:
+        """Array mapping codes of another encoder to codes of this encoder."""
+        return self.encode(other.labels)
+
+
 def select_matching_measurements(
         data: Sequence[Tuple[int, str, int, float, float, float]],
         column: int,
@@ -111,6 +171,7 @@ def split_into_intervals(
     """Extract intervals of fixed duration from a single series of measurements.
 
     Ignore measurements that have all zeros for time and acceleration values.
+    The loop runs as a compiled kernel when the accelerate module's jit backend is selected.
     """
     if check_id:
         ids = extract_user_set(data)
@@ -122,6 +183,8 @@ def split_into_intervals(
             raise ValueError("Expecting zero or one unique activities but found: {}".format(set(activities)))
     if len(data) < 2:
         return ()
+    if accelerate.use_jit():
+        return accelerate.split_into_intervals(data, interval_duration_in_nanoseconds, maximum_gap_in_nanoseconds)
     time_in_interval = 0
     interval = []
     out = []
@@ -0,0 +1,147 @@
+import os
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import serialize
+from feature_matrix import FeatureMatrix
+
+
+default_model_memory_limit_in_bytes = 512 * 2 ** 20
+
+
+def model_nbytes(model: Any) -> int:
+    """Bytes of numpy arrays held by a model, including nested classifiers and spatial indices."""
+    seen = set()
+
+    def _nbytes(value: Any) -> int:
+        if id(value) in seen:
+            return 0
+        seen.add(id(value))
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, (tuple, list)):
+            return sum(_nbytes(v) for v in value)
+        if isinstance(value, dict):
+            return sum(_nbytes(v) for v in value.values())
+        if hasattr(value, "__dict__"):
+            return sum(_nbytes(v) for v in vars(value).values())
+        return 0
+
+    return _nbytes(model)
+
+
+class MatrixModelLoader:
+    """Fit a model on one user's rows of a FeatureMatrix, or return None if the user has too few feature vectors."""
+    def __init__(self, matrix: FeatureMatrix, fit: Callable[[FeatureMatrix], Any], min_vectors: int = 1) -> None:
+        self.matrix = matrix
+        self.fit = fit
+        self.min_vectors = min_vectors
+
+    def __call__(self, user: int) -> Optional[Any]:
+        rows = self.matrix.select_users([user])
+        if len(rows) < max(self.min_vectors, 1):
+            return None
+        return self.fit(rows)
+
+
+class FileModelLoader:
+    """Load user models saved with serialize.save as "<directory>/user_<id>.bin", or None if there is no file."""
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def path(self, user: int) -> str:
+        return os.path.join(self.directory, "user_{}.bin".format(user))
+
+    def __call__(self, user: int) -> Optional[Any]:
+        path = self.path(user)
+        if not os.path.exists(path):
+            return None
+        return serialize.load(path)
+
+
+class UserModelCache:
+    """Per-user models loaded on demand and kept in a least recently used cache with a memory limit.
+
+    The loader returns a user's model or None for users without one (cold users), who are served by the global
+    model.  Models are evicted, least recently used first, while the bytes of cached models (see model_nbytes)
+    exceed the limit.  Safe to use from several threads.
+    """
+    def __init__(
+        self,
+        global_model: Any,
+        loader: Callable[[int], Optional[Any]],
+        memory_limit_in_bytes: int = default_model_memory_limit_in_bytes,
+    ) -> None:
+        self.global_model = global_model
+        self.loader = loader
+        self.memory_limit_in_bytes = memory_limit_in_bytes
+        self.models: OrderedDict = OrderedDict()
+        self.cold_users = set()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.fallbacks = 0
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __contains__(self, user: int) -> bool:
+        return user in self.models
+
+    def get(self, user: int) -> Any:
+        """Model for a user, loading it on a miss, or the global model for a cold user."""
+        with self.lock:
+            if user in self.models:
+                self.hits += 1
+                self.models.move_to_end(user)
+                return self.models[user][0]
+            self.misses += 1
+            if user in self.cold_users:
+                self.fallbacks += 1
+                return self.global_model
+        model = self.loader(user)
+        with self.lock:
+            if model is None:
+                self.cold_users.add(user)
+                self.fallbacks += 1
+                return self.global_model
+            if user not in self.models:
+                self.insert(user, model)
+            return model
+
+    def insert(self, user: int, model: Any) -> None:
+        """Cache a model (the lock must be held), evicting least recently used models to respect the limit.
+
+        A model larger than the whole limit is returned to the caller but never cached.
+        """
+        nbytes = model_nbytes(model)
+        if nbytes > self.memory_limit_in_bytes:
+            return
+        self.models[user] = (model, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.memory_limit_in_bytes:
+            _, (_, evicted_nbytes) = self.models.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+            self.evictions += 1
+
+    def invalidate(self, user: int) -> None:
+        """Forget a user's cached model or cold status, e.g. after the user's model has been refitted."""
+        with self.lock:
+            self.cold_users.discard(user)
+            if user in self.models:
+                self.nbytes -= self.models.pop(user)[1]
+
+    def counters(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "fallbacks": self.fallbacks,
+                "cached_models": len(self.models),
+                "cached_bytes": self.nbytes,
+            }
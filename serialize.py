@@ -0,0 +1,182 @@
+import json
+import numpy as np
+from typing import Dict, Tuple, Any, Union
+
+import parse
+import spatial
+from classification import GaussianNaiveBayesClassifier, KNNClassifier, CascadeClassifier
+
+
+# File layout: magic, header length (little endian uint64), JSON header, then arrays at aligned offsets.
+magic = b"ACCMODEL"
+format_version = 1
+alignment = 64
+
+random_projection_tree_arrays = ("order", "starts", "ends", "lefts", "rights", "directions", "thresholds")
+kd_tree_arrays = ("order", "node_start", "node_end", "node_left", "node_right", "node_lower", "node_upper")
+
+
+def _aligned(offset: int) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _naive_bayes_parts(classifier: GaussianNaiveBayesClassifier, prefix: str
+                       ) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    attributes = {"type": "gaussian_naive_bayes", "var_smoothing": classifier.var_smoothing}
+    arrays = {
+        prefix + "class_counts": classifier.class_counts,
+        prefix + "class_means": classifier.class_means,
+        prefix + "class_variances": classifier.class_variances,
+    }
+    return attributes, arrays
+
+
+def _knn_parts(classifier: KNNClassifier, prefix: str) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    attributes = {
+        "type": "knn",
+        "index": classifier.index,
+        "reduction": classifier.reduction,
+        "reduction_ratio": classifier.reduction_ratio,
+        "num_training_points": classifier.num_training_points,
+    }
+    arrays = {
+        prefix + "points": classifier.points,
+        prefix + "label_codes": classifier.label_codes,
+        prefix + "squared_norms": classifier.squared_norms,
+    }
+    index = classifier.spatial_index
+    if isinstance(index, spatial.KDTree):
+        attributes["leaf_size"] = index.leaf_size
+        for name in kd_tree_arrays:
+            arrays[prefix + "kd_tree/" + name] = getattr(index, name)
+    elif isinstance(index, spatial.RandomProjectionIndex):
+        attributes.update(num_trees=index.num_trees, num_probes=index.num_probes, bucket_size=index.bucket_size)
+        for i, tree in enumerate(index.trees):
+            for name, array in zip(random_projection_tree_arrays, tree):
+                arrays["{}trees/{}/{}".format(prefix, i, name)] = array
+    return attributes, arrays
+
+
+def _parts(classifier: Union[GaussianNaiveBayesClassifier, KNNClassifier, CascadeClassifier], prefix: str = ""
+           ) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+    if isinstance(classifier, GaussianNaiveBayesClassifier):
+        return _naive_bayes_parts(classifier, prefix)
+    if isinstance(classifier, KNNClassifier):
+        return _knn_parts(classifier, prefix)
+    if isinstance(classifier, CascadeClassifier):
+        naive_bayes_attributes, arrays = _naive_bayes_parts(classifier.naive_bayes, prefix + "naive_bayes/")
+        knn_attributes, knn_arrays = _knn_parts(classifier.knn, prefix + "knn/")
+        arrays.update(knn_arrays)
+        attributes = {"type": "cascade", "k": classifier.k, "threshold": classifier.threshold,
+                      "naive_bayes": naive_bayes_attributes, "knn": knn_attributes}
+        return attributes, arrays
+    raise ValueError("Expecting a naive Bayes, KNN or cascade classifier but found: {}".format(type(classifier)))
+
+
+def save(classifier: Union[GaussianNaiveBayesClassifier, KNNClassifier, CascadeClassifier], path: str) -> None:
+    """Write a fitted classifier, its label encoding and any KNN index to a single binary file."""
+    attributes, arrays = _parts(classifier)
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    descriptions = dict()
+    header = None
+    # The offsets depend on the header length so grow the reserved header until it fits.
+    reserved = alignment
+    while header is None or len(header) > reserved:
+        if header is not None:
+            reserved = _aligned(len(header))
+        offset = _aligned(len(magic) + 8 + reserved)
+        for name, array in arrays.items():
+            descriptions[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset = _aligned(offset + array.nbytes)
+        header = json.dumps({
+            "format_version": format_version,
+            "activities": list(classifier.encoder.labels),
+            "model": attributes,
+            "arrays": descriptions,
+        }).encode("utf-8")
+    with open(path, "wb") as file:
+        file.write(magic)
+        file.write(np.array(len(header), dtype="<u8").tobytes())
+        file.write(header)
+        for name, array in arrays.items():
+            file.seek(descriptions[name]["offset"])
+            file.write(array.tobytes())
+        file.truncate(offset)
+
+
+def _load_naive_bayes(attributes: Dict[str, Any], arrays: Dict[str, np.ndarray], encoder: parse.LabelEncoder,
+                      prefix: str) -> GaussianNaiveBayesClassifier:
+    return GaussianNaiveBayesClassifier.from_statistics(
+        encoder, arrays[prefix + "class_counts"], arrays[prefix + "class_means"], arrays[prefix + "class_variances"],
+        var_smoothing=attributes["var_smoothing"]
+    )
+
+
+def _load_knn(attributes: Dict[str, Any], arrays: Dict[str, np.ndarray], encoder: parse.LabelEncoder,
+              prefix: str) -> KNNClassifier:
+    classifier = KNNClassifier.__new__(KNNClassifier)
+    classifier.encoder = encoder
+    classifier.points = arrays[prefix + "points"]
+    classifier.label_codes = arrays[prefix + "label_codes"]
+    classifier.squared_norms = arrays[prefix + "squared_norms"]
+    classifier.num_training_points = attributes["num_training_points"]
+    classifier.reduction = attributes["reduction"]
+    classifier.reduction_ratio = attributes["reduction_ratio"]
+    classifier.index = attributes["index"]
+    classifier.spatial_index = None
+    if classifier.index == "kd_tree":
+        index = spatial.KDTree.__new__(spatial.KDTree)
+        index.points = classifier.points
+        index.leaf_size = attributes["leaf_size"]
+        for name in kd_tree_arrays:
+            setattr(index, name, arrays[prefix + "kd_tree/" + name])
+        classifier.spatial_index = index
+    elif classifier.index == "approximate":
+        index = spatial.RandomProjectionIndex.__new__(spatial.RandomProjectionIndex)
+        index.points = classifier.points
+        index.num_trees = attributes["num_trees"]
+        index.num_probes = attributes["num_probes"]
+        index.bucket_size = attributes["bucket_size"]
+        index.trees = tuple(
+            tuple(arrays["{}trees/{}/{}".format(prefix, i, name)] for name in random_projection_tree_arrays)
+            for i in range(index.num_trees)
+        )
+        classifier.spatial_index = index
+    return classifier
+
+
+def load(path: str) -> Union[GaussianNaiveBayesClassifier, KNNClassifier, CascadeClassifier]:
+    """Load a classifier written by save.
+
+    Arrays are read only views of a memory map of the file, so loading does not copy the training data and
+    processes that load the same file share one copy in the page cache.
+    """
+    buffer = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(buffer[:len(magic)]) != magic:
+        raise ValueError("Expecting a model file starting with {} but found: {}".format(magic, path))
+    header_length = int(buffer[len(magic): len(magic) + 8].view("<u8")[0])
+    header = json.loads(bytes(buffer[len(magic) + 8: len(magic) + 8 + header_length]).decode("utf-8"))
+    if header["format_version"] != format_version:
+        raise ValueError("Expecting format version {} but found: {}".format(format_version, header["format_version"]))
+    arrays = dict()
+    for name, description in header["arrays"].items():
+        dtype = np.dtype(description["dtype"])
+        shape = tuple(description["shape"])
+        start = description["offset"]
+        count = int(np.prod(shape))
+        arrays[name] = buffer[start: start + count * dtype.itemsize].view(dtype).reshape(shape)
+    encoder = parse.LabelEncoder(header["activities"])
+    attributes = header["model"]
+    if attributes["type"] == "gaussian_naive_bayes":
+        return _load_naive_bayes(attributes, arrays, encoder, "")
+    if attributes["type"] == "knn":
+        return _load_knn(attributes, arrays, encoder, "")
+    if attributes["type"] == "cascade":
+        classifier = CascadeClassifier.__new__(CascadeClassifier)
+        classifier.k = attributes["k"]
+        classifier.threshold = attributes["threshold"]
+        classifier.encoder = encoder
+        classifier.naive_bayes = _load_naive_bayes(attributes["naive_bayes"], arrays, encoder, "naive_bayes/")
+        classifier.knn = _load_knn(attributes["knn"], arrays, encoder, "knn/")
+        return classifier
+    raise ValueError("Expecting a known model type but found: {}".format(attributes["type"]))
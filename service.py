@@ -0,0 +1,233 @@
+import asyncio
+import codecs
+import itertools
+import time
+import numpy as np
+from collections import deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import parse
+from streaming import StreamWindower, Window
+
+
+default_read_size = 65536
+default_queue_size = 8
+default_latency_samples = 100000
+
+
+class ServiceStatistics:
+    """Counters and recent window latencies of a ClassificationService."""
+    def __init__(self, latency_samples: int = default_latency_samples) -> None:
+        self.start_time = time.perf_counter()
+        self.connections = 0
+        self.records = 0
+        self.windows = 0
+        self.errors = 0
+        self.connection_errors = 0
+        self.latencies = deque(maxlen=latency_samples)
+
+    def report(self) -> Dict[str, float]:
+        """Throughput since the service started and latency percentiles (in seconds) from data arrival to reply."""
+        elapsed = max(time.perf_counter() - self.start_time, 1e-9)
+        latencies = np.array(self.latencies) if len(self.latencies) > 0 else np.array([np.nan])
+        p50, p90, p99 = np.percentile(latencies, (50, 90, 99))
+        return {
+            "connections": self.connections,
+            "records": self.records,
+            "windows": self.windows,
+            "errors": self.errors,
+            "connection_errors": self.connection_errors,
+            "records_per_second": self.records / elapsed,
+            "windows_per_second": self.windows / elapsed,
+            "latency_p50": float(p50),
+            "latency_p90": float(p90),
+            "latency_p99": float(p99),
+        }
+
+
+class ClassificationService:
+    """asyncio TCP service that classifies WISDM format records ("user,activity,timestamp,x,y,z;") as they arrive.
+
+    Records from each connection are windowed per user with a streaming.StreamWindower.  Each chunk of input is
+    parsed and windowed in an executor, one chunk at a time per connection, and the features and predictions for the
+    windows it completes are computed in a separate executor call, so the event loop only moves bytes and keeps
+    serving other connections.  Each completed window is answered with
+    "user,activity,first_timestamp,last_timestamp;" and malformed records with "error,<message>;".  At most
+    queue_size chunks per connection wait for scoring: when the queue is full the connection is not read, and
+    replies wait for the client to drain them, so TCP flow control slows down clients that send faster than they can
+    be served or that read slowly.  A connection that fails (e.g. is reset by the client) stops reading and replying
+    and is counted in statistics.connection_errors; other errors are raised from the connection handler.
+
+    The classifier needs an encoder and a predict_batch method taking an array of feature vectors (extra keyword
+    arguments such as k are given in predict_options).
+    """
+    def __init__(
+        self,
+        classifier: Any,
+        feature_functions: Sequence[Callable[[np.ndarray, np.ndarray], Any]],
+        interval_duration_in_nanoseconds: int,
+        maximum_gap_in_nanoseconds: int,
+        executor: Optional[Executor] = None,
+        queue_size: int = default_queue_size,
+        read_size: int = default_read_size,
+        **predict_options
+    ) -> None:
+        self.classifier = classifier
+        self.feature_functions = tuple(feature_functions)
+        self.interval_duration_in_nanoseconds = interval_duration_in_nanoseconds
+        self.maximum_gap_in_nanoseconds = maximum_gap_in_nanoseconds
+        self.executor = ThreadPoolExecutor(max_workers=1) if executor is None else executor
+        self.owns_executor = executor is None
+        self.queue_size = queue_size
+        self.read_size = read_size
+        self.predict_options = predict_options
+        self.statistics = ServiceStatistics()
+        self.connection_ids = itertools.count()
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> asyncio.AbstractServer:
+        """Start listening (port 0 picks a free port, see self.port)."""
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server
+
+    @property
+    def port(self) -> int:
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.owns_executor:
+            self.executor.shutdown(wait=False)
+
+    def score(self, windows: Sequence[Window]) -> List[str]:
+        """Reply lines for completed windows (runs in the executor)."""
+        if len(windows) == 0:
+            return []
+        vectors = np.array([
+            [f(window.relative_times(), window.accelerations) for f in self.feature_functions] for window in windows
+        ], dtype=np.float64)
+        codes = self.classifier.predict_batch(vectors, **self.predict_options)
+        activities = self.classifier.encoder.decode(codes)
+        return ["{},{},{},{};\n".format(window.key[0], activity, window.times[0], window.times[-1])
+                for window, activity in zip(windows, activities)]
+
+    @staticmethod
+    def parse_records(text: str, windower: StreamWindower, connection_id: int, final: bool = False
+                      ) -> Tuple[List[Window], List[str], int, str]:
+        """Add the complete records of a chunk of text to the windower (runs in the executor).
+
+        Returns the completed windows, error replies, the number of records and the incomplete last record, which
+        is parsed as well at the end of the input (final), when the windower is also flushed.  Bytes that are not
+        valid UTF-8 are decoded as replacement characters and records containing them are answered with errors.
+        """
+        records = text.replace("\n", "").split(";")
+        remainder = "" if final else records.pop()
+        windows = []
+        errors = []
+        num_records = 0
+        for record in records:
+            if record.strip() == "":
+                continue
+            num_records += 1
+            if "\ufffd" in record:
+                errors.append("error,Expecting UTF-8 text but found invalid bytes;\n")
+                continue
+            try:
+                user, _, t, x, y, z = parse.timepoint_strings_to_timepoint_tuples((record,))[0]
+                windows.extend(windower.push((user, connection_id), t, x, y, z))
+            except (ValueError, IndexError) as error:
+                errors.append("error,{};\n".format(str(error).replace(";", ",").replace("\n", " ")))
+        if final:
+            windows.extend(windower.flush_all())
+        return windows, errors, num_records, remainder
+
+    @staticmethod
+    async def enqueue(pending: asyncio.Queue, replies: asyncio.Future, item: Any) -> None:
+        """Queue work for the reply writer, raising the writer's exception instead of waiting if it has stopped."""
+        put = asyncio.ensure_future(pending.put(item))
+        await asyncio.wait((put, replies), return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        if replies.done():
+            replies.result()
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        connection_id = next(self.connection_ids)
+        self.statistics.connections += 1
+        windower = StreamWindower(self.interval_duration_in_nanoseconds, self.maximum_gap_in_nanoseconds)
+        pending: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        replies = asyncio.ensure_future(self.write_replies(pending, writer))
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        remainder = ""
+        try:
+            while True:
+                chunk = await reader.read(self.read_size)
+                arrival = time.perf_counter()
+                if replies.done():
+                    replies.result()
+                final = len(chunk) == 0
+                windows, errors, num_records, remainder = await loop.run_in_executor(
+                    self.executor, self.parse_records, remainder + decoder.decode(chunk, final), windower,
+                    connection_id, final
+                )
+                self.statistics.records += num_records
+                self.statistics.errors += len(errors)
+                if len(windows) > 0 or len(errors) > 0 or final:
+                    scored = loop.run_in_executor(self.executor, self.score, windows)
+                    await self.enqueue(pending, replies, (arrival, errors, scored))
+                if final:
+                    break
+            await self.enqueue(pending, replies, None)
+            await replies
+        except ConnectionError:
+            self.statistics.connection_errors += 1
+        finally:
+            if not replies.done():
+                replies.cancel()
+            elif not replies.cancelled():
+                replies.exception()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def write_replies(self, pending: asyncio.Queue, writer: asyncio.StreamWriter) -> None:
+        """Write replies in arrival order, waiting for the client to read them before taking more work."""
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            arrival, errors, scored = item
+            lines = errors + await scored
+            writer.write("".join(lines).encode("utf-8"))
+            await writer.drain()
+            now = time.perf_counter()
+            num_windows = len(lines) - len(errors)
+            self.statistics.windows += num_windows
+            self.statistics.latencies.extend([now - arrival] * num_windows)
+
+
+async def classify_remote(host: str, port: int, data: Union[str, bytes], chunk_size: int = default_read_size
+                          ) -> List[str]:
+    """Send WISDM format records (text or encoded bytes) to a ClassificationService and return its reply records
+    once it closes."""
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def _send() -> None:
+        encoded = data.encode("utf-8") if isinstance(data, str) else data
+        for start in range(0, len(encoded), chunk_size):
+            writer.write(encoded[start: start + chunk_size])
+            await writer.drain()
+        writer.write_eof()
+
+    sender = asyncio.ensure_future(_send())
+    received = await reader.read()
+    await sender
+    writer.close()
+    await writer.wait_closed()
+    return list(parse.raw_data_string_to_timepoint_strings(received.decode("utf-8")))
@@ -0,0 +1,88 @@
+import atexit
+import numpy as np
+from multiprocessing import shared_memory
+from typing import Dict, Tuple, Sequence
+
+from feature_matrix import FeatureMatrix
+
+
+class SharedMatrixHandle:
+    """Small picklable description of a FeatureMatrix published in shared memory by SharedFeatureMatrix."""
+    def __init__(self, name: str, num_rows: int, num_features: int, users: Sequence[int], activities: Sequence[str]
+                 ) -> None:
+        self.name = name
+        self.num_rows = num_rows
+        self.num_features = num_features
+        self.users = tuple(users)
+        self.activities = tuple(activities)
+
+    def __repr__(self) -> str:
+        return "SharedMatrixHandle({!r}, {}, {})".format(self.name, self.num_rows, self.num_features)
+
+
+def _arrays(buffer, num_rows: int, num_features: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Views of the values, user codes, activity codes and interval ids laid out one after another in a buffer."""
+    values = np.ndarray((num_rows, num_features), dtype=np.float64, buffer=buffer)
+    offset = values.nbytes
+    columns = []
+    for _ in range(3):
+        columns.append(np.ndarray((num_rows,), dtype=np.int64, buffer=buffer, offset=offset))
+        offset += 8 * num_rows
+    return values, columns[0], columns[1], columns[2]
+
+
+class SharedFeatureMatrix:
+    """Copy of a FeatureMatrix in one block of OS shared memory that worker processes can attach to without copying.
+
+    Pass self.handle to workers and call attach(handle) there.  The block is unlinked by close(), on leaving a with
+    block or when the publishing process exits.
+    """
+    def __init__(self, matrix: FeatureMatrix) -> None:
+        num_rows, num_features = matrix.values.shape
+        self.memory = shared_memory.SharedMemory(create=True, size=max(8 * num_rows * (num_features + 3), 1))
+        arrays = _arrays(self.memory.buf, num_rows, num_features)
+        for target, source in zip(arrays, (matrix.values, matrix.user_codes, matrix.activity_codes,
+                                           matrix.interval_ids)):
+            target[...] = source
+        self.matrix = FeatureMatrix(*arrays, matrix.users, matrix.encoder)
+        self.handle = SharedMatrixHandle(self.memory.name, num_rows, num_features, matrix.users, matrix.activities)
+        self.closed = False
+        _attached[self.memory.name] = (self.memory, self.matrix)
+        atexit.register(self.close)
+
+    def __enter__(self) -> 'SharedFeatureMatrix':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Unlink the shared memory block.  Processes that are still attached keep their mapping until they exit."""
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        _attached.pop(self.memory.name, None)
+        self.matrix = None
+        self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            pass  # Arrays of the matrix are still referenced; the mapping is released when they are.
+
+
+# Matrices attached by this process, so that every task in a worker reuses one mapping.
+_attached: Dict[str, Tuple[shared_memory.SharedMemory, FeatureMatrix]] = dict()
+
+
+def attach(handle: SharedMatrixHandle) -> FeatureMatrix:
+    """Read only FeatureMatrix backed by the shared memory described by a handle."""
+    if handle.name in _attached:
+        return _attached[handle.name][1]
+    memory = shared_memory.SharedMemory(name=handle.name)
+    arrays = _arrays(memory.buf, handle.num_rows, handle.num_features)
+    for array in arrays:
+        array.flags.writeable = False
+    matrix = FeatureMatrix(*arrays, handle.users, handle.activities)
+    _attached[handle.name] = (memory, matrix)
+    return matrix
@@ -0,0 +1,302 @@
+import numpy as np
+from typing import Tuple
+
+import accelerate
+
+
+def _insert_neighbour(best_distances: np.ndarray, best_indices: np.ndarray, distance: float, index: int) -> None:
+    """Insert a candidate into arrays sorted by distance and then index, dropping the last entry."""
+    k = best_distances.shape[0]
+    position = k - 1
+    if distance > best_distances[position] or (distance == best_distances[position] and
+                                               index >= best_indices[position]):
+        return
+    while position > 0 and (distance < best_distances[position - 1] or
+                            (distance == best_distances[position - 1] and index < best_indices[position - 1])):
+        best_distances[position] = best_distances[position - 1]
+        best_indices[position] = best_indices[position - 1]
+        position -= 1
+    best_distances[position] = distance
+    best_indices[position] = index
+
+
+def _box_distance(lower: np.ndarray, upper: np.ndarray, query: np.ndarray) -> float:
+    """Squared distance from a point to the nearest point of an axis aligned box."""
+    out = 0.0
+    for j in range(query.shape[0]):
+        if query[j] < lower[j]:
+            out += (lower[j] - query[j]) ** 2
+        elif query[j] > upper[j]:
+            out += (query[j] - upper[j]) ** 2
+    return out
+
+
+insert_neighbour_kernel = accelerate.compile_kernel(_insert_neighbour)
+box_distance_kernel = accelerate.compile_kernel(_box_distance)
+
+
+def _kd_tree_query_kernel(
+    points: np.ndarray,
+    order: np.ndarray,
+    node_start: np.ndarray,
+    node_end: np.ndarray,
+    node_left: np.ndarray,
+    node_right: np.ndarray,
+    node_lower: np.ndarray,
+    node_upper: np.ndarray,
+    queries: np.ndarray,
+    k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Depth first k nearest neighbour search, visiting the nearer child first and pruning by bounding box.
+
+    Boxes at the same squared distance as the current k-th neighbour are still visited so that equal distances
+    are resolved by the lowest training index, as in a stable sort of all distances.
+    """
+    num_queries = queries.shape[0]
+    num_nodes = node_start.shape[0]
+    out_distances = np.empty((num_queries, k))
+    out_indices = np.empty((num_queries, k), np.int64)
+    stack_nodes = np.empty(num_nodes + 1, np.int64)
+    stack_distances = np.empty(num_nodes + 1)
+    for q in range(num_queries):
+        query = queries[q]
+        best_distances = np.full(k, np.inf)
+        best_indices = np.full(k, points.shape[0], np.int64)
+        stack_nodes[0] = 0
+        stack_distances[0] = box_distance_kernel(node_lower[0], node_upper[0], query)
+        size = 1
+        while size > 0:
+            size -= 1
+            node = stack_nodes[size]
+            if stack_distances[size] > best_distances[k - 1]:
+                continue
+            if node_left[node] < 0:
+                for position in range(node_start[node], node_end[node]):
+                    i = order[position]
+                    distance = 0.0
+                    for j in range(query.shape[0]):
+                        distance += (points[i, j] - query[j]) ** 2
+                    insert_neighbour_kernel(best_distances, best_indices, distance, i)
+                continue
+            left = node_left[node]
+            right = node_right[node]
+            left_distance = box_distance_kernel(node_lower[left], node_upper[left], query)
+            right_distance = box_distance_kernel(node_lower[right], node_upper[right], query)
+            if left_distance <= right_distance:
+                near, near_distance, far, far_distance = left, left_distance, right, right_distance
+            else:
+                near, near_distance, far, far_distance = right, right_distance, left, left_distance
+            stack_nodes[size] = far
+            stack_distances[size] = far_distance
+            stack_nodes[size + 1] = near
+            stack_distances[size + 1] = near_distance
+            size += 2
+        out_distances[q] = best_distances
+        out_indices[q] = best_indices
+    return out_distances, out_indices
+
+
+kd_tree_query_kernel = accelerate.compile_kernel(_kd_tree_query_kernel)
+
+
+class KDTree:
+    """KD-tree over a fixed set of points for exact k nearest neighbour queries.
+
+    Nodes are split at the median of their widest dimension until they hold at most leaf_size points.  The tree is
+    stored as flat arrays (node ranges into a permutation of the points, children and bounding boxes) so that the
+    query loop can run as a compiled kernel under the accelerate module's jit backend.
+    """
+    def __init__(self, points: np.ndarray, leaf_size: int = 40) -> None:
+        if leaf_size < 1:
+            raise ValueError("Expecting a leaf size of at least one but found: {}".format(leaf_size))
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        if self.points.ndim != 2:
+            raise ValueError("Expecting a 2-D array of points but found shape: {}".format(self.points.shape))
+        self.leaf_size = leaf_size
+        self.order = np.arange(len(self.points), dtype=np.int64)
+        starts, ends, lefts, rights, lowers, uppers = [], [], [], [], [], []
+
+        def _build(start: int, end: int) -> int:
+            node = len(starts)
+            members = self.points[self.order[start:end]]
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            lowers.append(np.min(members, axis=0) if end > start else np.zeros(self.points.shape[1]))
+            uppers.append(np.max(members, axis=0) if end > start else np.zeros(self.points.shape[1]))
+            if end - start <= leaf_size:
+                return node
+            dimension = int(np.argmax(uppers[node] - lowers[node]))
+            middle = (start + end) // 2
+            partition = np.argpartition(members[:, dimension], middle - start)
+            self.order[start:end] = self.order[start:end][partition]
+            lefts[node] = _build(start, middle)
+            rights[node] = _build(middle, end)
+            return node
+
+        _build(0, len(self.points))
+        self.node_start = np.array(starts, dtype=np.int64)
+        self.node_end = np.array(ends, dtype=np.int64)
+        self.node_left = np.array(lefts, dtype=np.int64)
+        self.node_right = np.array(rights, dtype=np.int64)
+        self.node_lower = np.array(lowers, dtype=np.float64).reshape(len(starts), self.points.shape[1])
+        self.node_upper = np.array(uppers, dtype=np.float64).reshape(len(starts), self.points.shape[1])
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Squared distances and indices of the k nearest points for each query, nearest first.
+
+        Equal distances are ordered by point index.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        k = min(k, len(self.points))
+        if k < 1:
+            return np.empty((len(queries), 0)), np.empty((len(queries), 0), dtype=np.int64)
+        kernel = kd_tree_query_kernel if accelerate.use_jit() else _kd_tree_query_kernel
+        return kernel(self.points, self.order, self.node_start, self.node_end, self.node_left, self.node_right,
+                      self.node_lower, self.node_upper, queries, k)
+
+
+class RandomProjectionIndex:
+    """Approximate nearest neighbour index built from a forest of random projection trees.
+
+    Each tree splits its points at the median of their projection onto a random direction until leaves hold at
+    most bucket_size points, so a query reaches a leaf in O(log N) steps and every leaf has a bounded size.  The
+    candidates for a query are the points in its leaf in each of num_trees trees, plus the leaves on the other
+    side of the num_probes splits along its path that it passed closest to.  Candidates are ranked by exact
+    distance.  More trees or probes give higher recall for a slower query and query cost stays nearly flat as the
+    training set grows.
+    """
+    def __init__(
+        self,
+        points: np.ndarray,
+        num_trees: int = 8,
+        num_probes: int = 2,
+        bucket_size: int = 32,
+        seed: int = 0,
+    ) -> None:
+        if num_trees < 1:
+            raise ValueError("Expecting at least one tree but found: {}".format(num_trees))
+        if bucket_size < 1:
+            raise ValueError("Expecting a bucket size of at least one but found: {}".format(bucket_size))
+        self.points = np.ascontiguousarray(points, dtype=np.float64)
+        if self.points.ndim != 2:
+            raise ValueError("Expecting a 2-D array of points but found shape: {}".format(self.points.shape))
+        self.num_trees = num_trees
+        self.num_probes = num_probes
+        self.bucket_size = bucket_size
+        rng = np.random.RandomState(seed)
+        self.trees = tuple(self._build_tree(rng) for _ in range(num_trees))
+
+    def _build_tree(self, rng: np.random.RandomState) -> Tuple[np.ndarray, ...]:
+        """Flat arrays (order, start, end, left, right, direction, threshold) describing one tree."""
+        num_features = self.points.shape[1]
+        order = np.arange(len(self.points), dtype=np.int64)
+        starts, ends, lefts, rights, directions, thresholds = [], [], [], [], [], []
+
+        def _build(start: int, end: int) -> int:
+            node = len(starts)
+            starts.append(start)
+            ends.append(end)
+            lefts.append(-1)
+            rights.append(-1)
+            direction = rng.randn(num_features)
+            directions.append(direction)
+            thresholds.append(0.0)
+            if end - start <= self.bucket_size:
+                return node
+            projections = self.points[order[start:end]] @ direction
+            middle = (start + end) // 2
+            partition = np.argpartition(projections, middle - start)
+            order[start:end] = order[start:end][partition]
+            thresholds[node] = float(projections[partition[middle - start]])
+            lefts[node] = _build(start, middle)
+            rights[node] = _build(middle, end)
+            return node
+
+        _build(0, len(self.points))
+        return (order, np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64),
+                np.array(lefts, dtype=np.int64), np.array(rights, dtype=np.int64),
+                np.array(directions).reshape(len(starts), num_features), np.array(thresholds))
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    @staticmethod
+    def _descend(tree: Tuple[np.ndarray, ...], queries: np.ndarray, nodes: np.ndarray
+                 ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Leaf reached by each query from a starting node, with the nodes passed and the margins at each."""
+        _, _, _, lefts, rights, directions, thresholds = tree
+        path_nodes = []
+        path_margins = []
+        nodes = nodes.copy()
+        internal = lefts[nodes] >= 0
+        while np.any(internal):
+            margins = np.full(len(nodes), np.inf)
+            active = nodes[internal]
+            margins[internal] = np.einsum('ij,ij->i', queries[internal], directions[active]) - thresholds[active]
+            path_nodes.append(nodes.copy())
+            path_margins.append(margins)
+            nodes[internal] = np.where(margins[internal] < 0, lefts[active], rights[active])
+            internal = lefts[nodes] >= 0
+        return nodes, np.array(path_nodes).reshape(-1, len(nodes)), np.array(path_margins).reshape(-1, len(nodes))
+
+    def leaves(self, queries: np.ndarray) -> np.ndarray:
+        """Leaf node reached by each query in each tree, including probes (trees x (1 + probes) x queries)."""
+        queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        out = []
+        for tree in self.trees:
+            lefts, rights = tree[3], tree[4]
+            root = np.zeros(len(queries), dtype=np.int64)
+            leaf, path_nodes, path_margins = RandomProjectionIndex._descend(tree, queries, root)
+            tree_leaves = [leaf]
+            # Splits sorted by how close each query passed to them.
+            closest = np.argsort(np.abs(path_margins), axis=0)
+            columns = np.arange(len(queries))
+            for probe in range(self.num_probes):
+                if probe >= len(path_nodes):
+                    # A shallow tree has fewer splits than probes, so repeat the leaf to keep one entry per probe.
+                    tree_leaves.append(leaf)
+                    continue
+                node = path_nodes[closest[probe], columns]
+                margin = path_margins[closest[probe], columns]
+                valid = np.isfinite(margin)
+                other_side = np.where(margin < 0, rights[node], lefts[node])
+                other_side = np.where(valid, other_side, leaf)
+                tree_leaves.append(RandomProjectionIndex._descend(tree, queries, other_side)[0])
+            out.append(tree_leaves)
+        return np.array(out, dtype=np.int64).reshape(self.num_trees, -1, len(queries))
+
+    def query(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate squared distances and indices of the k nearest points for each query, nearest first.
+
+        Rows are padded with infinite distances and index len(self) when fewer than k candidates are found.
+        """
+        queries = np.ascontiguousarray(queries, dtype=np.float64).reshape(-1, self.points.shape[1])
+        k = min(k, len(self.points))
+        out_distances = np.full((len(queries), k), np.inf)
+        out_indices = np.full((len(queries), k), len(self.points), dtype=np.int64)
+        leaves = self.leaves(queries)
+        for q, query in enumerate(queries):
+            ranges = []
+            for tree, tree_leaves in zip(self.trees, leaves):
+                order, starts, ends = tree[0], tree[1], tree[2]
+                for leaf in tree_leaves[:, q]:
+                    ranges.append(order[starts[leaf]: ends[leaf]])
+            candidates = np.unique(np.concatenate(ranges))
+            distances = ((self.points[candidates] - query) ** 2).sum(axis=1)
+            order = np.lexsort((candidates, distances))[:k]
+            out_distances[q, :len(order)] = distances[order]
+            out_indices[q, :len(order)] = candidates[order]
+        return out_distances, out_indices
+
+
+def recall(approximate_indices: np.ndarray, exact_indices: np.ndarray) -> float:
+    """Fraction of the exact k nearest neighbours that were also found by an approximate search."""
+    if exact_indices.size == 0:
+        return 1.0
+    found = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate_indices, exact_indices))
+    return found / exact_indices.size
@@ -0,0 +1,148 @@
+import numpy as np
+from typing import Any, Dict, Hashable, Iterable, List, Sequence
+
+
+default_window_capacity = 1024
+
+
+class Window:
+    """A completed measurement interval of one stream.
+
+    Times are in nanoseconds and accelerations is a (3 x n) array, the arguments expected by the feature functions
+    in the features module (after subtracting the first time).
+    """
+    def __init__(self, key: Hashable, times: np.ndarray, accelerations: np.ndarray) -> None:
+        self.key = key
+        self.times = times
+        self.accelerations = accelerations
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def relative_times(self) -> np.ndarray:
+        return self.times - self.times[0]
+
+    def __repr__(self) -> str:
+        return "Window({!r}, {} measurements)".format(self.key, len(self.times))
+
+
+class StreamState:
+    """Interval being assembled for one stream, held in preallocated arrays of fixed capacity."""
+    __slots__ = ("times", "accelerations", "length", "time_in_interval", "last_time", "previous_time")
+
+    def __init__(self, capacity: int) -> None:
+        self.times = np.empty(capacity, dtype=np.int64)
+        self.accelerations = np.empty((3, capacity), dtype=np.float64)
+        self.length = 0
+        self.time_in_interval = 0
+        self.last_time = 0
+        self.previous_time = None
+
+    def restart(self, t: int, x: float, y: float, z: float) -> None:
+        """Start a new interval at a measurement."""
+        self.times[0] = t
+        self.accelerations[:, 0] = (x, y, z)
+        self.length = 1
+        self.time_in_interval = 0
+        self.last_time = t
+
+
+class StreamWindower:
+    """Assemble measurement intervals from live streams, one measurement or a small batch at a time.
+
+    Each stream (e.g. a (user, device) pair) is split with the same rules as parse.split_into_intervals: invalid
+    all-zero measurements and repeated times are skipped, large gaps restart the interval, a step back in time
+    starts a new measurement period and intervals are kept if they end within the maximum gap of the duration.
+    Memory per stream is bounded by capacity measurements and each measurement costs O(1).  An interval that would
+    hold more than capacity measurements is discarded and counted in self.overflows.
+    """
+    def __init__(
+        self,
+        interval_duration_in_nanoseconds: int,
+        maximum_gap_in_nanoseconds: int,
+        capacity: int = default_window_capacity,
+    ) -> None:
+        if capacity < 1:
+            raise ValueError("Expecting a capacity of at least one but found: {}".format(capacity))
+        self.interval_duration_in_nanoseconds = interval_duration_in_nanoseconds
+        self.maximum_gap_in_nanoseconds = maximum_gap_in_nanoseconds
+        self.capacity = capacity
+        self.streams: Dict[Hashable, StreamState] = dict()
+        self.overflows = 0
+
+    def __len__(self) -> int:
+        return len(self.streams)
+
+    def emit(self, key: Hashable, state: StreamState) -> Window:
+        return Window(key, state.times[:state.length].copy(), state.accelerations[:, :state.length].copy())
+
+    def push(self, key: Hashable, t: int, x: float, y: float, z: float) -> List[Window]:
+        """Add one measurement to a stream and return the intervals it completes (zero or one)."""
+        state = self.streams.get(key)
+        if state is None:
+            state = self.streams[key] = StreamState(self.capacity)
+        out = []
+        # Skip invalid measurements.
+        if t == 0 and x == 0 and y == 0 and z == 0:
+            state.previous_time = t
+            return out
+        # Handle first valid measurement in current interval.
+        if state.length == 0:
+            state.restart(t, x, y, z)
+            state.previous_time = t
+            return out
+        # Ignore repeated time points even if the first measurement is not valid.
+        if state.previous_time == t:
+            return out
+        duration = self.interval_duration_in_nanoseconds
+        maximum_gap = self.maximum_gap_in_nanoseconds
+        time_gap = t - state.last_time
+        # Raise before changing any state so that the stream can continue without the measurement.
+        if time_gap == 0:
+            raise ValueError("Expecting time to increase in stream {} but found time {} twice".format(key, t))
+        # Reset interval because a step back in time indicates the start of a new measurement period.
+        if time_gap < 0:
+            if duration - state.time_in_interval < maximum_gap:
+                out.append(self.emit(key, state))
+            state.restart(t, x, y, z)
+            return out
+        state.time_in_interval += time_gap
+        if state.time_in_interval <= duration and time_gap > maximum_gap:
+            state.restart(t, x, y, z)
+        elif state.time_in_interval > duration:
+            if duration - (state.time_in_interval - time_gap) <= maximum_gap:
+                out.append(self.emit(key, state))
+            state.restart(t, x, y, z)
+        elif state.length == self.capacity:
+            self.overflows += 1
+            state.restart(t, x, y, z)
+        else:
+            state.times[state.length] = t
+            state.accelerations[:, state.length] = (x, y, z)
+            state.length += 1
+            state.last_time = t
+        state.previous_time = t
+        return out
+
+    def extend(self, key: Hashable, measurements: Iterable[Sequence[Any]]) -> List[Window]:
+        """Add a batch of (time, x, y, z) measurements to a stream and return the completed intervals."""
+        out = []
+        for t, x, y, z in measurements:
+            out.extend(self.push(key, t, x, y, z))
+        return out
+
+    def flush(self, key: Hashable) -> List[Window]:
+        """End a stream, returning its final interval if it is close enough to the full duration."""
+        state = self.streams.pop(key, None)
+        if state is None or state.length == 0:
+            return []
+        if self.interval_duration_in_nanoseconds - state.time_in_interval <= self.maximum_gap_in_nanoseconds:
+            return [self.emit(key, state)]
+        return []
+
+    def flush_all(self) -> List[Window]:
+        out = []
+        for key in list(self.streams):
+            out.extend(self.flush(key))
+        return out
+
@@ -0,0 +1,59 @@
+import pytest
+import numpy as np
+
+import accelerate
+from helpers import nanoseconds_in_one_second, random_series, recursive_resolve_ties, split_with_backend
+
+
+def test_set_backend_raises_for_unknown_backend():
+    with pytest.raises(ValueError):
+        accelerate.set_backend("fortran")
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_accelerated_split_into_intervals_matches_python_backend(seed):
+    series = random_series(seed, 2000)
+    duration = nanoseconds_in_one_second * 2
+    gap = nanoseconds_in_one_second
+    expected = split_with_backend("python", series, duration, gap)
+    result = accelerate.split_into_intervals(series, duration, gap)
+    assert len(expected) > 0
+    assert result == expected
+
+
+@pytest.mark.skipif(not accelerate.jit_available(), reason="numba is not installed")
+def test_split_into_intervals_gives_same_result_for_both_backends():
+    series = random_series(11, 3000)
+    duration = nanoseconds_in_one_second * 3
+    gap = nanoseconds_in_one_second // 2
+    expected = split_with_backend("python", series, duration, gap)
+    result = split_with_backend("jit", series, duration, gap)
+    assert result == expected
+
+
+def test_accelerated_split_into_intervals_raises_like_python_backend():
+    series = (
+        (7, "Walking", 100, 1.0, 1.0, 1.0),
+        (7, "Walking", 0, 0, 0, 0),
+        (7, "Walking", 100, 1.0, 1.0, 1.0),
+    )
+    with pytest.raises(ValueError):
+        split_with_backend("python", series, 1000, 500)
+    with pytest.raises(ValueError):
+        accelerate.split_into_intervals(series, 1000, 500)
+
+
+def test_resolve_ties_matches_recursive_version_on_random_labels():
+    rng = np.random.RandomState(3)
+    names = ("a", "b", "c", "d")
+    for _ in range(500):
+        codes = rng.randint(0, len(names), size=rng.randint(1, 15))
+        k = int(rng.randint(1, 20))
+        expected = recursive_resolve_ties(tuple(names[c] for c in codes), k)
+        result = names[accelerate.resolve_ties(codes, k, len(names))]
+        assert result == expected
+
+
+def test_resolve_ties_raises_given_no_neighbours():
+    with pytest.raises(ValueError):
+        accelerate.resolve_ties(np.array([0, 1]), 0, 2)
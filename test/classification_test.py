@@ -1,8 +1,13 @@
+import pytest
+import tracemalloc
 import numpy as np
-from numpy.testing import assert_array_equal
+from numpy.testing import assert_array_equal, assert_almost_equal
 
 import classification
+import parse
 from classification import GaussianNaiveBayesClassifier, KNNClassifier
+from feature_matrix import FeatureMatrix
+from helpers import clusters, recursive_resolve_ties
 
 
 def test_train_test_folds_returns_expected_values():
@@ -175,3 +180,335 @@ def test_resolve_ties_handles_all_tied_case():
     expected = 'a'
     result = KNNClassifier.resolve_ties(labels, 5)
     assert result == expected
+
+
+def test_confusion_matrix_from_codes_returns_expected_array():
+    actual = np.array([0, 0, 1, 2, 2, 2])
+    predicted = np.array([0, 1, 1, 2, 0, 2])
+    expected = np.array([
+        [1, 1, 0],
+        [0, 1, 0],
+        [1, 0, 2],
+    ])
+    result = classification.confusion_matrix_from_codes(actual, predicted, 3)
+    assert_array_equal(result, expected)
+
+
+def test_predicted_and_labeled_codes_match_pairs():
+    train = clusters(0, 5, 2)
+    test = {(3, a): vectors for (u, a), vectors in clusters(1, 5, 2).items() if u == 1 and a != "Jogging"}
+    encoder = parse.LabelEncoder(("Jogging", "Sitting", "Walking"))
+    for classifier, args in (
+        (GaussianNaiveBayesClassifier(train, encoder), ()),
+        (KNNClassifier(train, encoder), (3,)),
+    ):
+        pairs = classifier.predicted_and_labeled_pairs(test, *args)
+        actual, predicted = classifier.predicted_and_labeled_codes(test, *args)
+        assert tuple(zip(encoder.decode(actual), encoder.decode(predicted))) == pairs
+
+
+def test_knn_classifier_reuses_feature_matrix_codes_and_encoder():
+    train = clusters(19, 5, 2)
+    matrix = FeatureMatrix.from_dict(train)
+    classifier = KNNClassifier(matrix)
+    assert classifier.encoder is matrix.encoder
+    assert classifier.label_codes is matrix.activity_codes
+    encoder = parse.LabelEncoder(("Walking", "Upstairs", "Sitting", "Jogging"))
+    translated = KNNClassifier(matrix, encoder)
+    assert translated.labels == matrix.labels() == KNNClassifier(train, encoder).labels
+
+
+def test_knn_classifier_keeps_one_array_of_training_points():
+    matrix = FeatureMatrix.from_dict({(1, "a"): ((1.0, 2.0), (3.0, 4.0)), (2, "b"): ((5.0, 6.0),)})
+    classifier = KNNClassifier(matrix)
+    assert classifier.points is matrix.values
+    assert classifier.locations is classifier.points
+
+
+def test_squared_distances_match_distances_to_points():
+    rng = np.random.RandomState(1)
+    train = {(1, "a"): tuple(tuple(v) for v in rng.randn(20, 3)), (2, "b"): tuple(tuple(v) for v in rng.randn(7, 3))}
+    queries = rng.randn(4, 3)
+    classifier = KNNClassifier(train)
+    result = classifier.squared_distances(queries)
+    expected = np.array([KNNClassifier.distances_to_points(q, classifier.points) for q in queries]) ** 2
+    assert_almost_equal(result, expected)
+
+
+def test_predict_batch_matches_predict_code_from_feature_vector():
+    train = clusters(2, 30, 5, ("Jogging", "Sitting", "Walking", "Upstairs"))
+    queries = np.random.RandomState(3).randn(50, 5) * 2 + 2
+    classifier = KNNClassifier(train)
+    for k in (1, 4, 11):
+        expected = np.array([classifier.predict_code_from_feature_vector(q, k) for q in queries])
+        result = classifier.predict_batch(queries, k)
+        assert_array_equal(result, expected)
+
+
+def test_block_sizes_stay_within_memory_budget():
+    rng = np.random.RandomState(3)
+    classifier = KNNClassifier({(1, "a"): tuple(tuple(v) for v in rng.randn(1000, 2))})
+    budget = 20000
+    query_block, training_block = classifier.block_sizes(500, 5, budget)
+    assert query_block * (training_block + 2 * 5) * classification.bytes_per_distance_entry <= budget
+    assert training_block < 1000
+
+
+def test_exact_nearest_indices_peak_memory_stays_within_budget():
+    rng = np.random.RandomState(18)
+    classifier = KNNClassifier({(1, "a"): tuple(tuple(v) for v in rng.randn(3000, 4))})
+    queries = rng.randn(200, 4)
+    for k in (1, 50):
+        for budget in (200000, 2000000):
+            tracemalloc.start()
+            base = tracemalloc.get_traced_memory()[0]
+            result = classifier.exact_nearest_indices(queries, k, budget)
+            peak = tracemalloc.get_traced_memory()[1] - base - result.nbytes
+            tracemalloc.stop()
+            assert peak <= budget
+
+
+def test_nearest_indices_do_not_depend_on_memory_budget():
+    train = clusters(4, 40, 3)
+    queries = np.random.RandomState(5).randn(37, 3) + 1.5
+    classifier = KNNClassifier(train)
+    expected = np.argsort(classifier.squared_distances(queries), axis=1, kind='stable')[:, :7]
+    for budget in (200, 5000, 10 ** 9):
+        result = classifier.nearest_indices(queries, 7, memory_budget_in_bytes=budget)
+        assert_array_equal(result, expected)
+        assert_array_equal(classifier.predict_batch(queries, 7, budget), classifier.predict_batch(queries, 7))
+
+
+def test_resolve_ties_matches_recursive_algorithm_on_random_labels():
+    rng = np.random.RandomState(5)
+    for _ in range(1000):
+        labels = tuple(int(v) for v in rng.randint(0, 4, size=rng.randint(1, 20)))
+        k = int(rng.randint(1, 25))
+        assert KNNClassifier.resolve_ties(labels, k) == recursive_resolve_ties(labels, k)
+
+
+def test_nearest_k_indices_matches_stable_sort_including_ties():
+    rng = np.random.RandomState(6)
+    for _ in range(200):
+        distances = rng.randint(0, 5, size=rng.randint(1, 30)).astype(float)
+        k = int(rng.randint(1, 35))
+        expected = np.argsort(distances, kind='stable')[:k]
+        assert_array_equal(KNNClassifier.nearest_k_indices(distances, k), expected)
+
+
+def test_predict_batch_gives_same_result_for_any_number_of_workers():
+    train = clusters(7, 50, 4)
+    queries = np.random.RandomState(8).randn(101, 4) + 1.5
+    for index in ("brute", "kd_tree"):
+        classifier = KNNClassifier(train, index=index)
+        expected = classifier.predict_batch(queries, 5)
+        for num_workers in (2, 3, 8, 500):
+            assert_array_equal(classifier.predict_batch(queries, 5, num_workers=num_workers), expected)
+
+
+def test_predict_batch_orders_duplicated_points_by_index_for_any_budget_and_workers():
+    rng = np.random.RandomState(17)
+    train = {(u, a): tuple(tuple(v) for v in rng.randint(0, 3, size=(20, 2)).astype(float))
+             for u in (1, 2) for a in ("Jogging", "Sitting", "Walking")}
+    queries = rng.randint(0, 3, size=(200, 2)).astype(float)
+    classifier = KNNClassifier(train)
+    for k in (1, 2, 5, 9):
+        expected_indices = np.argsort(classifier.squared_distances(queries), axis=1, kind='stable')[:, :k]
+        expected = np.array([classifier.predict_code_from_feature_vector(q, k) for q in queries])
+        for budget in (1000, 5000, 10 ** 9):
+            assert_array_equal(classifier.nearest_indices(queries, k, budget), expected_indices)
+            assert_array_equal(classifier.predict_batch(queries, k, budget), expected)
+        assert_array_equal(classifier.predict_batch(queries, k, num_workers=3), expected)
+
+
+def test_condensed_training_set_classifies_all_training_points_correctly():
+    train = clusters(8, 100, 2)
+    classifier = KNNClassifier(train, reduction="condensed")
+    full = KNNClassifier(train)
+    assert classifier.reduction_ratio < 0.6
+    assert len(classifier.points) == len(classifier.labels) == len(classifier.label_codes)
+    assert_array_equal(classifier.predict_batch(full.points, 1), full.label_codes)
+
+
+def test_edited_training_set_drops_point_surrounded_by_other_class():
+    train = {
+        (1, "a"): ((0.0, 0.0), (0.1, 0.0), (0.0, 0.1), (0.1, 0.1)),
+        (1, "b"): ((0.05, 0.05), (5.0, 5.0), (5.1, 5.0), (5.0, 5.1)),
+    }
+    classifier = KNNClassifier(train, reduction="edited")
+    assert not np.any(np.all(classifier.points == (0.05, 0.05), axis=1))
+    assert len(classifier.points) == 7
+    assert classifier.reduction_ratio == 7 / 8
+
+
+def test_knn_reduction_report_returns_ratio_and_accuracy_change():
+    train = clusters(9, 80, 2)
+    test = clusters(10, 20, 2)
+    result = classification.knn_reduction_report(train, test, 5, "edited_condensed")
+    assert 0 < result["reduction_ratio"] < 1
+    assert result["accuracy_change"] == result["reduced_accuracy"] - result["accuracy"]
+    assert result["reduced_accuracy"] > 0.5
+
+
+def test_k_sweep_matches_separate_prediction_for_each_k():
+    train = clusters(11, 40, 2)
+    test = clusters(12, 10, 2)
+    classifier = KNNClassifier(train)
+    result = classifier.k_sweep(test, 12)
+    assert sorted(result.keys()) == list(range(1, 13))
+    for k, (predicted, matrix) in result.items():
+        actual, expected = classifier.predicted_and_labeled_codes(test, k)
+        assert_array_equal(predicted, expected)
+        assert_array_equal(matrix, classification.confusion_matrix_from_codes(actual, expected, 3))
+
+
+def test_predictions_count_test_activities_missing_from_training_as_misclassified():
+    train = clusters(26, 20, 2)
+    test = dict(clusters(27, 5, 2))
+    test[(3, "Upstairs")] = tuple(tuple(v) for v in np.random.RandomState(28).randn(4, 2))
+    knn = KNNClassifier(train)
+    naive_bayes = GaussianNaiveBayesClassifier(train, knn.encoder)
+    cascade = classification.CascadeClassifier(train, k=3)
+    for classifier, args in ((knn, (3,)), (naive_bayes, ()), (cascade, ())):
+        actual, predicted = classifier.predicted_and_labeled_codes(test, *args)
+        assert classifier.encoder.labels == ("Jogging", "Sitting", "Walking")
+        assert np.sum(actual == 3) == 4
+        assert np.all(predicted < 3)
+        assert len(classifier.predict_codes(test, *args)) == len(actual)
+    result = knn.k_sweep(test, 4)
+    assert all(matrix.shape == (4, 4) and np.sum(matrix[3]) == 4 and np.sum(matrix[:, 3]) == 0
+               for _, matrix in result.values())
+    assert cascade.operating_points(test, (0.5,))[0]["accuracy"] < 1.0
+    assert classification.knn_reduction_report(train, test, 3, "condensed")["accuracy"] < 1.0
+
+
+def test_leave_one_out_codes_match_refitting_without_each_point():
+    train = {(1, "a"): tuple(tuple(v) for v in np.random.RandomState(13).randn(15, 2)),
+             (1, "b"): tuple(tuple(v) for v in np.random.RandomState(14).randn(15, 2) + 1)}
+    classifier = KNNClassifier(train)
+    actual, predicted = classifier.leave_one_out_codes(5, memory_budget_in_bytes=1000)
+    for budget in (600, 10 ** 9):
+        assert_array_equal(classifier.leave_one_out_codes(5, budget)[1], predicted)
+    points = list(zip(map(tuple, classifier.points), classifier.labels))
+    for i, (x, label) in enumerate(points):
+        others = {(1, "a"): tuple(p for j, (p, l) in enumerate(points) if j != i and l == "a"),
+                  (1, "b"): tuple(p for j, (p, l) in enumerate(points) if j != i and l == "b")}
+        refit = KNNClassifier(others, encoder=classifier.encoder)
+        assert predicted[i] == refit.predict_batch(np.array([x]), 5)[0]
+        assert actual[i] == classifier.encoder.encode_one(label)
+
+
+def test_exclude_self_raises_given_other_queries():
+    classifier = KNNClassifier({(1, "a"): ((0.0,), (1.0,))})
+    with pytest.raises(ValueError):
+        classifier.exact_nearest_indices(np.array([[0.0]]), 1, exclude_self=True)
+
+
+def test_gaussian_naive_bayes_batch_prediction_matches_feature_vector_prediction():
+    train = clusters(12, 80, 2)
+    queries = np.random.RandomState(13).randn(200, 2) * 2 + 1.5
+    classifier = GaussianNaiveBayesClassifier(train, {"Jogging", "Sitting", "Walking"})
+    expected = [classifier.predict_from_feature_vector(q) for q in queries]
+    assert classifier.encoder.decode(classifier.predict_batch(queries)) == tuple(expected)
+    probabilities = classifier.p_activity_given_x(queries[0])
+    expected_joint = [np.log(probabilities[a]) for a in classifier.encoder]
+    assert_almost_equal(classifier.joint_log_likelihood(queries[:1])[0], expected_joint, decimal=6)
+
+
+def test_gaussian_naive_bayes_batch_prediction_does_not_underflow():
+    rng = np.random.RandomState(14)
+    train = {(1, "Jogging"): tuple(tuple(v) for v in rng.randn(50, 400)),
+             (1, "Walking"): tuple(tuple(v) for v in rng.randn(50, 400) + 1)}
+    classifier = GaussianNaiveBayesClassifier(train, {"Jogging", "Walking"})
+    queries = np.vstack([rng.randn(10, 400) * 3, rng.randn(10, 400) * 3 + 1])
+    # The product of 400 densities underflows for every class so the feature vector path cannot decide.
+    assert all(p == 0 for p in classifier.p_activity_given_x(queries[0]).values())
+    log_proba = classifier.predict_log_proba(queries)
+    assert np.all(np.isfinite(log_proba))
+    assert_almost_equal(np.exp(log_proba).sum(axis=1), np.ones(20))
+    assert_array_equal(classifier.predict_batch(queries), [0] * 10 + [1] * 10)
+
+
+def test_gaussian_naive_bayes_smooths_zero_variance_features():
+    train = {(1, "Jogging"): ((0.0, 1.0), (1.0, 1.0), (2.0, 1.0)),
+             (1, "Walking"): ((5.0, 2.0), (6.0, 2.0), (7.0, 2.0))}
+    classifier = GaussianNaiveBayesClassifier(train, {"Jogging", "Walking"})
+    assert np.all(np.isfinite(classifier.inverse_variances))
+    assert_array_equal(classifier.predict_batch(np.array([[1.0, 1.0], [6.0, 2.0], [3.0, 2.0]])), [0, 1, 1])
+
+
+def test_gaussian_naive_bayes_partial_fit_matches_fitting_all_data():
+    data = clusters(15, 90, 2)
+    activities = {"Jogging", "Sitting", "Walking"}
+    expected = GaussianNaiveBayesClassifier(data, activities)
+    classifier = GaussianNaiveBayesClassifier({k: v for k, v in data.items() if k[0] == 1}, activities)
+    for activity in sorted(activities):
+        classifier.partial_fit({(2, activity): data[(2, activity)]})
+    assert_array_equal(classifier.class_counts, expected.class_counts)
+    assert_almost_equal(classifier.class_means, expected.class_means)
+    assert_almost_equal(classifier.class_variances, expected.class_variances)
+    assert_almost_equal(classifier.log_priors, expected.log_priors)
+    queries = np.random.RandomState(16).randn(50, 2) + 1.5
+    assert_array_equal(classifier.predict_batch(queries), expected.predict_batch(queries))
+
+
+def test_gaussian_naive_bayes_partial_fit_from_empty_statistics_is_numerically_stable():
+    rng = np.random.RandomState(17)
+    encoder = parse.LabelEncoder(("Jogging", "Walking"))
+    classifier = GaussianNaiveBayesClassifier.from_statistics(encoder, np.zeros(2), np.zeros((2, 1)), np.zeros((2, 1)))
+    batches = [rng.randn(100, 1) * 1e-3 + 1e9 for _ in range(20)]
+    for batch in batches:
+        matrix = FeatureMatrix(batch, np.zeros(100), np.zeros(100), np.arange(100), (1,), encoder)
+        classifier.partial_fit(matrix)
+    values = np.vstack(batches)
+    assert_array_equal(classifier.class_counts, [2000, 0])
+    assert_almost_equal(classifier.class_means[0], np.mean(values, axis=0))
+    assert_almost_equal(classifier.class_variances[0] / np.var(values - 1e9, axis=0), [1.0], decimal=4)
+    assert classifier.p_activities == {"Jogging": 1.0, "Walking": 0.0}
+
+
+def test_gaussian_naive_bayes_from_statistics_raises_given_mismatched_shapes():
+    with pytest.raises(ValueError):
+        GaussianNaiveBayesClassifier.from_statistics({"a", "b"}, np.ones(2), np.zeros((3, 1)), np.zeros((3, 1)))
+
+
+def test_gaussian_naive_bayes_feature_log_densities_sum_to_joint_log_likelihood():
+    classifier = GaussianNaiveBayesClassifier(clusters(18, 40, 2), {"Jogging", "Sitting", "Walking"})
+    queries = np.random.RandomState(19).randn(30, 2)
+    result = classifier.log_priors + np.sum(classifier.feature_log_densities(queries), axis=2)
+    assert_almost_equal(result, classifier.joint_log_likelihood(queries))
+
+
+def test_cascade_classifier_matches_naive_bayes_and_knn_at_extreme_thresholds():
+    train = clusters(20, 60, 2)
+    queries = np.random.RandomState(21).randn(100, 2) * 2 + 1.5
+    cascade = classification.CascadeClassifier(train, k=5)
+    naive_bayes = GaussianNaiveBayesClassifier(train, cascade.encoder)
+    knn = KNNClassifier(train, cascade.encoder)
+    assert_array_equal(cascade.predict_batch(queries, threshold=0.0), naive_bayes.predict_batch(queries))
+    assert_array_equal(cascade.predict_batch(queries, threshold=1.1), knn.predict_batch(queries, 5))
+
+
+def test_cascade_classifier_escalates_only_uncertain_vectors():
+    train = clusters(22, 60, 2)
+    queries = np.random.RandomState(23).randn(100, 2) * 2 + 1.5
+    cascade = classification.CascadeClassifier(train, k=5, threshold=0.3)
+    naive_bayes_codes, margins = cascade.posterior_margins(queries)
+    assert np.all((margins >= 0) & (margins <= 1))
+    predicted, escalated = cascade.predict_batch_and_escalations(queries)
+    assert_array_equal(escalated, margins < 0.3)
+    assert_array_equal(predicted[~escalated], naive_bayes_codes[~escalated])
+    assert_array_equal(predicted[escalated], cascade.knn.predict_batch(queries[escalated], 5))
+
+
+def test_cascade_operating_points_report_escalation_accuracy_and_latency():
+    cascade = classification.CascadeClassifier(clusters(24, 60, 2), k=5)
+    test = clusters(25, 20, 2)
+    result = cascade.operating_points(test, (0.0, 0.5, 1.1))
+    assert [r["threshold"] for r in result] == [0.0, 0.5, 1.1]
+    assert result[0]["escalation_fraction"] == 0.0
+    assert result[2]["escalation_fraction"] == 1.0
+    assert 0.0 < result[1]["escalation_fraction"] < 1.0
+    actual, predicted = cascade.predicted_and_labeled_codes(test, 0.5)
+    assert result[1]["accuracy"] == np.mean(actual == predicted)
+    assert all(r["seconds_per_vector"] > 0 for r in result)
@@ -0,0 +1,99 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal, assert_almost_equal
+
+import cross_validation
+from classification import GaussianNaiveBayesClassifier, confusion_matrix_from_codes
+from feature_matrix import FeatureMatrix
+
+
+def _random_matrix(seed, num_users=8, activities=("Jogging", "Sitting", "Walking")):
+    rng = np.random.RandomState(seed)
+    data = {(user, activity): tuple(tuple(v) for v in rng.randn(rng.randint(5, 30), 4) + i + 0.1 * user)
+            for user in range(num_users) for i, activity in enumerate(activities)}
+    # One user without any data for one activity.
+    data[(0, "Sitting")] = ()
+    return FeatureMatrix.from_dict(data)
+
+
+def test_leave_one_user_out_folds_returns_expected_values():
+    result = cross_validation.leave_one_user_out_folds((3, 1, 2))
+    assert result == (({1, 2}, {3}), ({2, 3}, {1}), ({1, 3}, {2}))
+
+
+def test_subtract_statistics_inverts_merge():
+    rng = np.random.RandomState(1)
+    values = rng.randn(60, 3) + 100
+    codes = rng.randint(0, 2, size=60)
+    first = GaussianNaiveBayesClassifier.class_statistics(values[:20], codes[:20], 3)
+    second = GaussianNaiveBayesClassifier.class_statistics(values[20:], codes[20:], 3)
+    total = GaussianNaiveBayesClassifier.merge_statistics(first, second)
+    result = cross_validation.subtract_statistics(total, second)
+    for r, e in zip(result, first):
+        assert_almost_equal(r, e)
+
+
+def test_subtract_statistics_raises_given_larger_part():
+    statistics = (np.array([1]), np.zeros((1, 1)), np.zeros((1, 1)))
+    larger = (np.array([2]), np.zeros((1, 1)), np.zeros((1, 1)))
+    with pytest.raises(ValueError):
+        cross_validation.subtract_statistics(statistics, larger)
+
+
+def test_cross_validate_matches_refitting_each_fold():
+    matrix = _random_matrix(2)
+    statistics = cross_validation.UserStatistics(matrix)
+    folds = cross_validation.leave_one_user_out_folds(matrix.users)
+    result = statistics.cross_validate(folds)
+    assert len(result) == len(matrix.users)
+    for (train_ids, test_ids), confusion in zip(folds, result):
+        train, test = matrix.split_by_users(train_ids, test_ids)
+        classifier = GaussianNaiveBayesClassifier(train, matrix.encoder)
+        derived = statistics.classifier_without(test_ids)
+        assert_array_equal(derived.class_counts, classifier.class_counts)
+        assert_almost_equal(derived.class_means, classifier.class_means)
+        assert_almost_equal(derived.class_variances, classifier.class_variances)
+        expected = confusion_matrix_from_codes(test.activity_codes, classifier.predict_batch(test.values), 3)
+        assert_array_equal(confusion, expected)
+
+
+def test_cross_validate_accepts_folds_with_several_test_users():
+    matrix = _random_matrix(3)
+    statistics = cross_validation.UserStatistics(matrix)
+    folds = (({0, 1, 2, 3}, {4, 5, 6, 7}), ({4, 5, 6, 7}, {0, 1, 2, 3}))
+    result = statistics.cross_validate(folds)
+    assert sum(np.sum(c) for c in result) == len(matrix)
+
+
+def test_fold_seeds_are_reproducible_and_distinct():
+    assert cross_validation.fold_seeds(5, 4) == cross_validation.fold_seeds(5, 4)
+    assert len(set(cross_validation.fold_seeds(5, 4))) == 4
+    assert cross_validation.fold_seeds(5, 4) != cross_validation.fold_seeds(6, 4)
+
+
+def test_run_folds_with_naive_bayes_matches_user_statistics():
+    matrix = _random_matrix(4)
+    folds = cross_validation.leave_one_user_out_folds(matrix.users)
+    result = cross_validation.run_folds(matrix, folds, cross_validation.naive_bayes_factory)
+    expected = cross_validation.UserStatistics(matrix).cross_validate(folds)
+    for r, e in zip(result["confusion_matrices"], expected):
+        assert_array_equal(r, e)
+    assert_array_equal(result["confusion_matrix"], sum(expected))
+    assert result["accuracy"] == pytest.approx(np.trace(sum(expected)) / len(matrix))
+    assert len(result["accuracies"]) == len(folds)
+
+
+def test_run_folds_results_do_not_depend_on_number_of_workers():
+    matrix = _random_matrix(5, num_users=4)
+    folds = cross_validation.leave_one_user_out_folds(matrix.users)
+    factory = cross_validation.KNNFactory(5, index="approximate", num_trees=2, num_probes=0, bucket_size=4)
+    serial = cross_validation.run_folds(matrix, folds, factory, seed=3)
+    parallel = cross_validation.run_folds(matrix, folds, factory, seed=3, num_workers=2)
+    for s, p in zip(serial["confusion_matrices"], parallel["confusion_matrices"]):
+        assert_array_equal(s, p)
+
+
+def test_run_folds_raises_given_no_workers():
+    matrix = _random_matrix(6, num_users=2)
+    with pytest.raises(ValueError):
+        cross_validation.run_folds(matrix, (), cross_validation.naive_bayes_factory, num_workers=0)
@@ -0,0 +1,69 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import parse
+from feature_matrix import FeatureMatrix
+from classification import GaussianNaiveBayesClassifier, KNNClassifier
+
+
+def _random_feature_dict(seed, users=(1, 2, 3, 4, 5), activities=("Jogging", "Sitting", "Walking")):
+    rng = np.random.RandomState(seed)
+    out = dict()
+    for user in users:
+        for i, activity in enumerate(activities):
+            num_intervals = rng.randint(1, 8)
+            out[(user, activity)] = tuple(
+                tuple(float(v) for v in rng.randn(3) + i) for _ in range(num_intervals)
+            )
+    return out
+
+
+def test_from_dict_returns_expected_columns():
+    given = {
+        (3, "Walking"): ((1.0, 2.0), (3.0, 4.0)),
+        (1, "Jogging"): ((5.0, 6.0),),
+        (1, "Walking"): (),
+    }
+    result = FeatureMatrix.from_dict(given)
+    assert_array_equal(result.values, np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]))
+    assert_array_equal(result.user_codes, np.array([1, 1, 0]))
+    assert_array_equal(result.activity_codes, np.array([1, 1, 0]))
+    assert_array_equal(result.interval_ids, np.array([0, 1, 0]))
+    assert result.users == (1, 3)
+    assert result.activities == ("Jogging", "Walking")
+    assert result.labels() == ("Walking", "Walking", "Jogging")
+
+
+def test_to_dict_reverses_from_dict_for_non_empty_series():
+    given = _random_feature_dict(0)
+    result = FeatureMatrix.from_dict(given).to_dict()
+    assert result == given
+
+
+def test_constructor_raises_given_mismatched_columns():
+    with pytest.raises(ValueError):
+        FeatureMatrix(np.zeros((3, 2)), [0, 0], [0, 0, 0], [0, 1, 2], (1,), ("Walking",))
+
+
+def test_select_users_matches_collect_dict_values_by_listed_key_contents():
+    given = _random_feature_dict(1)
+    matrix = FeatureMatrix.from_dict(given)
+    expected = parse.collect_dict_values_by_listed_key_contents(given, {2, 4})
+    result = matrix.select_users({2, 4, 99})
+    assert result.to_dict() == expected
+    assert result.users == matrix.users
+
+
+def test_classifiers_give_same_pairs_for_dict_and_matrix():
+    train = _random_feature_dict(2, users=(1, 2, 3))
+    test = _random_feature_dict(3, users=(4, 5))
+    activities = {"Jogging", "Sitting", "Walking"}
+    train_matrix = FeatureMatrix.from_dict(train)
+    test_matrix = FeatureMatrix.from_dict(test)
+    expected_nb = GaussianNaiveBayesClassifier(train, activities).predicted_and_labeled_pairs(test)
+    result_nb = GaussianNaiveBayesClassifier(train_matrix, activities).predicted_and_labeled_pairs(test_matrix)
+    assert result_nb == expected_nb
+    expected_knn = KNNClassifier(train).predicted_and_labeled_pairs(test, 3)
+    result_knn = KNNClassifier(train_matrix).predicted_and_labeled_pairs(test_matrix, 3)
+    assert result_knn == expected_knn
@@ -0,0 +1,54 @@
+import pytest
+import numpy as np
+
+import cross_validation
+from classification import accuracy_from_confusion_matrix
+from feature_matrix import FeatureMatrix
+from feature_selection import FeatureSubsetScorer
+
+
+def _matrix_with_informative_columns(seed):
+    """Columns 1 and 3 separate the activities, the other columns are noise."""
+    rng = np.random.RandomState(seed)
+    n = 600
+    codes = rng.randint(0, 3, size=n)
+    values = rng.randn(n, 5)
+    values[:, 1] += 2.0 * codes
+    values[:, 3] += 1.5 * (codes == 2)
+    users = rng.randint(0, 6, size=n)
+    return FeatureMatrix(values, users, codes, np.arange(n), tuple(range(6)), ("Jogging", "Sitting", "Walking"))
+
+
+def test_accuracy_matches_cross_validating_a_refitted_subset():
+    matrix = _matrix_with_informative_columns(1)
+    scorer = FeatureSubsetScorer(matrix)
+    for subset in ((1,), (0, 2), (1, 3), (0, 1, 2, 3, 4)):
+        columns = FeatureMatrix(matrix.values[:, subset], matrix.user_codes, matrix.activity_codes,
+                                matrix.interval_ids, matrix.users, matrix.encoder)
+        confusion = sum(cross_validation.UserStatistics(columns).cross_validate())
+        assert scorer.accuracy(subset) == accuracy_from_confusion_matrix(confusion)
+
+
+def test_forward_selection_picks_informative_features_first():
+    scorer = FeatureSubsetScorer(_matrix_with_informative_columns(2))
+    path = scorer.forward_selection(max_features=3)
+    assert len(path) == 3
+    assert path[0][0] == (1,)
+    assert set(path[1][0]) == {1, 3}
+    assert path[1][1] > path[0][1]
+    for subset, accuracy in path:
+        assert accuracy == scorer.accuracy(subset)
+
+
+def test_backward_elimination_keeps_informative_features_last():
+    scorer = FeatureSubsetScorer(_matrix_with_informative_columns(3))
+    path = scorer.backward_elimination(min_features=2)
+    assert path[0][0] == (0, 1, 2, 3, 4)
+    assert set(path[-1][0]) == {1, 3}
+    for subset, accuracy in path:
+        assert accuracy == pytest.approx(scorer.accuracy(subset))
+
+
+def test_backward_elimination_raises_given_invalid_min_features():
+    with pytest.raises(ValueError):
+        FeatureSubsetScorer(_matrix_with_informative_columns(4)).backward_elimination(min_features=0)
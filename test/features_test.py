@@ -1,3 +1,4 @@
+import pytest
 import numpy as np
 from numpy.testing import assert_array_equal, assert_almost_equal
 
@@ -264,3 +265,53 @@ def test_extract_vectors_from_dict_handles_three_entry_case():
     result = features.extract_vectors_from_dict(given)
     assert_array_equal(result[0], expected[0])
     assert_array_equal(result[1], expected[1])
+
+
+def _random_window_data(seed, length):
+    rng = np.random.RandomState(seed)
+    t = np.cumsum(rng.randint(40, 60, size=length)) * 1000000
+    return t, rng.randn(3, length) * 3 + np.array([[0.5], [9.0], [-1.0]])
+
+
+def test_sliding_window_features_match_batch_features_as_window_slides():
+    t, x = _random_window_data(1, 300)
+    window = features.SlidingWindowFeatures(40)
+    start = 0
+    for end in range(len(t)):
+        window.append(t[end], x[:, end])
+        if end - start + 1 > 37:
+            window.pop()
+            start += 1
+        if end - start < 1:
+            continue
+        tw, xw = t[start: end + 1] - t[start], x[:, start: end + 1]
+        assert_almost_equal(window.mean_y_acceleration(), features.mean_y_acceleration(tw, xw))
+        assert_almost_equal(window.mean_of_magnitudes(), features.mean_of_magnitudes(xw))
+        assert_almost_equal(window.variance_of_magnitudes(), features.variance_of_magnitudes(xw))
+        assert_almost_equal(window.mean_magnitude_change_per_second(),
+                            features.mean_magnitude_change_per_second(tw, xw))
+        assert_almost_equal(window.mean_absolute_magnitude_change_per_second(),
+                            features.mean_absolute_magnitude_change_per_second(tw, xw))
+        assert_almost_equal(window.mean_angle_change_per_second(), features.mean_angle_change_per_second(tw, xw))
+
+
+def test_sliding_window_features_raise_when_full_or_empty():
+    window = features.SlidingWindowFeatures(1)
+    window.append(0, (1.0, 2.0, 3.0))
+    with pytest.raises(ValueError):
+        window.append(1, (1.0, 2.0, 3.0))
+    window.pop()
+    with pytest.raises(ValueError):
+        window.pop()
+    assert np.isnan(window.mean_x_acceleration())
+
+
+def test_sliding_window_vectors_match_batch_feature_vectors():
+    t, x = _random_window_data(2, 500)
+    functions = (features.mean_x_acceleration, features.mean_z_acceleration,
+                 features.mean_absolute_magnitude_change_per_second, features.mean_angle_change_per_second)
+    for window_length, hop in ((50, 10), (20, 25), (7, 1)):
+        result = features.sliding_window_vectors(t, x, window_length, hop, functions)
+        starts = range(0, len(t) - window_length + 1, hop)
+        expected = [[f(t[s: s + window_length] - t[s], x[:, s: s + window_length]) for f in functions] for s in starts]
+        assert_almost_equal(result, np.array(expected))
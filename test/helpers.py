@@ -0,0 +1,71 @@
+import contextlib
+import numpy as np
+
+import accelerate
+import parse
+
+
+nanoseconds_in_one_second = 1000000000
+
+
+@contextlib.contextmanager
+def using_backend(backend):
+    """Select an accelerate backend for the duration of a with block."""
+    previous = accelerate.get_backend()
+    accelerate.set_backend(backend)
+    try:
+        yield
+    finally:
+        accelerate.set_backend(previous)
+
+
+def random_series(seed, length):
+    """Series with duplicated times, all-zero rows, large gaps and steps back in time."""
+    rng = np.random.RandomState(seed)
+    out = []
+    t = 1000 * nanoseconds_in_one_second
+    repeat_allowed = False
+    for _ in range(length):
+        event = rng.rand()
+        if event < 0.05:
+            out.append((7, "Walking", 0, 0, 0, 0))
+            repeat_allowed = False
+            continue
+        elif event < 0.1:
+            if not repeat_allowed:
+                continue  # Repeats after all-zero rows or steps back in time raise in both backends.
+        elif event < 0.12:
+            t -= int(rng.randint(1, 30)) * nanoseconds_in_one_second
+            out.append((7, "Walking", t, float(rng.randn()), float(rng.randn()), float(rng.randn())))
+            repeat_allowed = False
+            continue
+        elif event < 0.15:
+            t += int(rng.randint(2, 5)) * nanoseconds_in_one_second
+        else:
+            t += int(rng.randint(40, 60)) * 1000000
+        repeat_allowed = True
+        out.append((7, "Walking", t, float(rng.randn()), float(rng.randn()), float(rng.randn())))
+    return tuple(out)
+
+
+def split_with_backend(backend, series, duration, gap):
+    """parse.split_into_intervals with the given backend, "python" giving the reference result."""
+    with using_backend(backend):
+        return parse.split_into_intervals(series, duration, gap)
+
+
+def clusters(seed, size, num_features, activities=("Jogging", "Sitting", "Walking")):
+    """Training data of users 1 and 2 with size feature vectors per activity around overlapping cluster centres."""
+    rng = np.random.RandomState(seed)
+    return {(u, a): tuple(tuple(v) for v in rng.randn(size, num_features) + 1.5 * i)
+            for u in (1, 2) for i, a in enumerate(activities)}
+
+
+def recursive_resolve_ties(sorted_labels, k):
+    """Reference tie resolution: the most frequent of the top k labels, retrying with k - 1 while counts are tied."""
+    top_k = list(sorted_labels[:k])
+    labels = list(set(top_k))
+    counts = [top_k.count(label) for label in labels]
+    if len(set(counts)) == len(counts):
+        return labels[int(np.argmax(counts))]
+    return recursive_resolve_ties(sorted_labels, k - 1)
@@ -0,0 +1,120 @@
+import pytest
+import warnings
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import accelerate
+import features
+import interval_sweep
+import parse
+from feature_matrix import FeatureMatrix
+from helpers import nanoseconds_in_one_second, using_backend
+
+
+feature_functions = (features.mean_x_acceleration, features.mean_y_acceleration,
+                     features.mean_absolute_magnitude_change_per_second)
+
+
+def _random_measurements(seed, users=(3, 4, 5, 6), activities=("Jogging", "Walking"), length=400):
+    """Series with all-zero rows, large gaps and steps back in time for every user and activity."""
+    rng = np.random.RandomState(seed)
+    out = []
+    for user in users:
+        for i, activity in enumerate(activities):
+            t = 1000 * nanoseconds_in_one_second
+            for _ in range(length):
+                event = rng.rand()
+                if event < 0.03:
+                    out.append((user, activity, 0, 0, 0, 0))
+                    continue
+                elif event < 0.04:
+                    t -= int(rng.randint(1, 30)) * nanoseconds_in_one_second
+                elif event < 0.07:
+                    t += int(rng.randint(2, 5)) * nanoseconds_in_one_second
+                else:
+                    t += int(rng.randint(40, 60)) * 1000000
+                out.append((user, activity, t, float(rng.randn() + 2 * i), float(rng.randn() - i), float(rng.randn())))
+    return tuple(out)
+
+
+def _expected(data, duration, gap):
+    with using_backend("python"):
+        intervals = parse.intervals_by_user_and_activity(data, duration, gap)
+    return intervals, features.vectors_for_intervals(intervals, feature_functions)
+
+
+def test_feature_vectors_match_vectors_for_intervals():
+    data = _random_measurements(1)
+    arrays = interval_sweep.series_arrays(data)
+    duration, gap = 2 * nanoseconds_in_one_second, nanoseconds_in_one_second
+    intervals, expected = _expected(data, duration, gap)
+    result = interval_sweep.feature_vectors(arrays, interval_sweep.interval_indices(arrays, duration, gap),
+                                            feature_functions)
+    assert result.keys() == expected.keys()
+    for key in expected:
+        assert_array_equal(np.array(result[key]).reshape(-1, 3), np.array(expected[key]).reshape(-1, 3))
+
+
+def test_sweep_matches_parsing_each_setting_from_scratch():
+    data = _random_measurements(2)
+    durations = (nanoseconds_in_one_second, 3 * nanoseconds_in_one_second)
+    gaps = (nanoseconds_in_one_second // 10, nanoseconds_in_one_second)
+    result = interval_sweep.sweep_interval_parameters(data, durations, gaps, feature_functions)
+    assert [(r["interval_duration_in_nanoseconds"], r["maximum_gap_in_nanoseconds"]) for r in result] == \
+        [(d, g) for d in durations for g in gaps]
+    for r in result:
+        intervals, vectors = _expected(data, r["interval_duration_in_nanoseconds"], r["maximum_gap_in_nanoseconds"])
+        assert r["intervals_per_activity"] == parse.count_intervals_per_activity(intervals)
+        assert r["intervals_per_user"] == parse.count_intervals_per_user(intervals)
+        assert r["accuracy"] == interval_sweep.naive_bayes_accuracy(FeatureMatrix.from_dict(vectors))
+
+
+def test_parallel_sweep_matches_serial_sweep():
+    data = _random_measurements(3, length=200)
+    durations = (nanoseconds_in_one_second, 2 * nanoseconds_in_one_second)
+    gaps = (nanoseconds_in_one_second,)
+    serial = interval_sweep.sweep_interval_parameters(data, durations, gaps, feature_functions)
+    parallel = interval_sweep.sweep_interval_parameters(data, durations, gaps, feature_functions, num_workers=2)
+    assert serial == parallel
+
+
+def _backend_interval_indices(backend, arrays, duration, gap):
+    with using_backend(backend):
+        return interval_sweep.interval_indices(arrays, duration, gap)
+
+
+@pytest.mark.skipif(not accelerate.jit_available(), reason="numba is not installed")
+def test_precomputed_gaps_match_python_backend_with_repeats_after_steps_back():
+    rng = np.random.RandomState(4)
+    for _ in range(50):
+        times = np.cumsum(rng.choice([-3, 0, 1, 1, 2, 5], size=60)) + 100
+        zeros = rng.rand(60) < 0.1
+        data = tuple((1, "Walking", 0 if z else int(t), 0.0 if z else 1.0, 0.0, 0.0) for t, z in zip(times, zeros))
+        arrays = interval_sweep.series_arrays(data)
+        for duration, gap in ((4, 1), (6, 2), (10, 3), (3, 5)):
+            try:
+                expected = _backend_interval_indices("python", arrays, duration, gap)
+            except ValueError:
+                with pytest.raises(ValueError):
+                    _backend_interval_indices("jit", arrays, duration, gap)
+                continue
+            result = _backend_interval_indices("jit", arrays, duration, gap)
+            assert [[m.tolist() for m in v] for v in result.values()] == \
+                [[m.tolist() for m in v] for v in expected.values()]
+
+
+def test_sweep_skips_series_without_intervals_without_warnings():
+    data = _random_measurements(5, users=(3, 4), activities=("Jogging",)) + \
+        ((5, "Walking", 10, 1.0, 1.0, 1.0), (5, "Walking", 11, 1.0, 1.0, 1.0))
+    mean_features = (features.mean_x_acceleration, features.mean_y_acceleration)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        result = interval_sweep.sweep_interval_parameters(data, (nanoseconds_in_one_second,),
+                                                          (nanoseconds_in_one_second // 10,), mean_features)
+    assert result[0]["intervals_per_activity"]["Walking"] == 0
+    assert result[0]["accuracy"] == 1.0
+
+
+def test_sweep_raises_given_no_workers():
+    with pytest.raises(ValueError):
+        interval_sweep.sweep_interval_parameters((), (1,), (1,), feature_functions, num_workers=0)
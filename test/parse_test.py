@@ -1119,3 +1119,30 @@ def test_collect_dict_values_by_listed_key_contents_returns_expected_dict_for_us
     }
     result = parse.collect_dict_values_by_listed_key_contents(given, ids)
     assert result == expected
+
+
+def test_label_encoder_encodes_and_decodes_sorted_labels():
+    encoder = parse.LabelEncoder.from_labels(["Walking", "Jogging", "Walking", "Sitting"])
+    assert encoder.labels == ("Jogging", "Sitting", "Walking")
+    codes = encoder.encode(("Walking", "Jogging", "Walking"))
+    assert_array_equal(codes, np.array([2, 0, 2]))
+    assert encoder.decode(codes) == ("Walking", "Jogging", "Walking")
+
+
+def test_label_encoder_raises_given_unknown_label():
+    encoder = parse.LabelEncoder(("Jogging", "Walking"))
+    with pytest.raises(ValueError):
+        encoder.encode(("Sitting",))
+
+
+def test_label_encoder_translation_from_maps_codes_between_encoders():
+    encoder = parse.LabelEncoder(("Jogging", "Sitting", "Walking"))
+    other = parse.LabelEncoder(("Walking", "Jogging"))
+    assert_array_equal(encoder.translation_from(other), np.array([2, 0]))
+
+
+def test_label_encoder_extended_with_keeps_codes_and_appends_unseen_labels():
+    encoder = parse.LabelEncoder(("Sitting", "Jogging"))
+    assert encoder.extended_with(("Jogging", "Sitting")) is encoder
+    extended = encoder.extended_with(("Walking", "Jogging", "Downstairs", "Walking"))
+    assert extended.labels == ("Sitting", "Jogging", "Downstairs", "Walking")
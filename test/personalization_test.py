@@ -0,0 +1,79 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import personalization
+import serialize
+from classification import GaussianNaiveBayesClassifier, KNNClassifier
+from feature_matrix import FeatureMatrix
+
+
+def _matrix(seed, rows_per_user=(40, 40, 40, 3)):
+    rng = np.random.RandomState(seed)
+    user_codes = np.repeat(np.arange(len(rows_per_user)), rows_per_user)
+    n = len(user_codes)
+    codes = rng.randint(0, 2, size=n)
+    values = rng.randn(n, 3) + codes[:, np.newaxis] + user_codes[:, np.newaxis]
+    return FeatureMatrix(values, user_codes, codes, np.arange(n), (10, 11, 12, 13), ("Jogging", "Walking"))
+
+
+def _fit(matrix):
+    return KNNClassifier(matrix, matrix.encoder)
+
+
+def test_model_nbytes_counts_arrays_of_nested_models():
+    matrix = _matrix(1)
+    classifier = KNNClassifier(matrix, index="kd_tree")
+    expected = classifier.points.nbytes + classifier.label_codes.nbytes + classifier.squared_norms.nbytes
+    assert personalization.model_nbytes(classifier) > expected
+
+
+def test_cache_counts_hits_misses_and_falls_back_for_cold_users():
+    matrix = _matrix(2)
+    global_model = GaussianNaiveBayesClassifier(matrix, matrix.encoder)
+    loader = personalization.MatrixModelLoader(matrix, _fit, min_vectors=10)
+    cache = personalization.UserModelCache(global_model, loader)
+    model = cache.get(10)
+    assert isinstance(model, KNNClassifier)
+    assert cache.get(10) is model
+    assert cache.get(13) is global_model
+    assert cache.get(13) is global_model
+    assert cache.get(99) is global_model
+    counters = cache.counters()
+    assert (counters["hits"], counters["misses"], counters["fallbacks"], counters["evictions"]) == (1, 4, 3, 0)
+    assert counters["cached_models"] == 1
+    assert counters["cached_bytes"] == personalization.model_nbytes(model)
+
+
+def test_cache_evicts_least_recently_used_models_at_memory_limit():
+    matrix = _matrix(3)
+    loader = personalization.MatrixModelLoader(matrix, _fit)
+    model_size = personalization.model_nbytes(loader(10))
+    cache = personalization.UserModelCache(None, loader, memory_limit_in_bytes=2 * model_size)
+    cache.get(10)
+    cache.get(11)
+    cache.get(10)
+    cache.get(12)  # Evicts user 11, the least recently used.
+    assert 10 in cache and 12 in cache and 11 not in cache
+    assert cache.counters()["evictions"] == 1
+    assert cache.nbytes <= cache.memory_limit_in_bytes
+    cache.invalidate(10)
+    assert len(cache) == 1
+
+
+def test_cache_does_not_keep_models_larger_than_the_limit():
+    matrix = _matrix(4)
+    cache = personalization.UserModelCache(None, personalization.MatrixModelLoader(matrix, _fit),
+                                           memory_limit_in_bytes=10)
+    assert isinstance(cache.get(10), KNNClassifier)
+    assert len(cache) == 0
+
+
+def test_file_model_loader_loads_saved_models(tmp_path):
+    matrix = _matrix(5)
+    model = _fit(matrix.select_users([11]))
+    loader = personalization.FileModelLoader(str(tmp_path))
+    serialize.save(model, loader.path(11))
+    assert loader(10) is None
+    loaded = loader(11)
+    queries = np.random.RandomState(6).randn(10, 3)
+    assert_array_equal(loaded.predict_batch(queries, 3), model.predict_batch(queries, 3))
@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import serialize
+from classification import GaussianNaiveBayesClassifier, KNNClassifier, CascadeClassifier
+from helpers import clusters
+
+
+def _round_trip(classifier, tmp_path):
+    path = str(tmp_path / "model.bin")
+    serialize.save(classifier, path)
+    return serialize.load(path)
+
+
+def test_naive_bayes_round_trip_gives_same_predictions(tmp_path):
+    classifier = GaussianNaiveBayesClassifier(clusters(1, 50, 3), {"Jogging", "Sitting", "Walking"})
+    loaded = _round_trip(classifier, tmp_path)
+    queries = np.random.RandomState(2).randn(40, 3) + 1.5
+    assert loaded.encoder == classifier.encoder
+    assert_array_equal(loaded.class_counts, classifier.class_counts)
+    assert_array_equal(loaded.predict_log_proba(queries), classifier.predict_log_proba(queries))
+    assert loaded.predict_from_feature_vector(queries[0]) == classifier.predict_from_feature_vector(queries[0])
+
+
+@pytest.mark.parametrize("options", [
+    dict(),
+    dict(index="kd_tree", leaf_size=5),
+    dict(index="approximate", num_trees=3, num_probes=1, bucket_size=8),
+    dict(reduction="condensed"),
+])
+def test_knn_round_trip_gives_same_predictions_from_a_memory_map(tmp_path, options):
+    classifier = KNNClassifier(clusters(3, 60, 3), **options)
+    loaded = _round_trip(classifier, tmp_path)
+    queries = np.random.RandomState(4).randn(40, 3) + 1.5
+    assert loaded.encoder == classifier.encoder
+    assert not loaded.points.flags.writeable
+    assert isinstance(loaded.points.base, np.memmap) or isinstance(loaded.points.base.base, np.memmap)
+    assert not loaded.label_codes.flags.writeable
+    assert loaded.labels == classifier.labels
+    assert loaded.reduction_ratio == classifier.reduction_ratio
+    for k in (1, 4):
+        assert_array_equal(loaded.predict_batch(queries, k), classifier.predict_batch(queries, k))
+    assert loaded.predict_from_feature_vector(queries[0], 3) == classifier.predict_from_feature_vector(queries[0], 3)
+
+
+def test_cascade_round_trip_gives_same_predictions(tmp_path):
+    classifier = CascadeClassifier(clusters(5, 40, 3), k=3, threshold=0.4, index="kd_tree")
+    loaded = _round_trip(classifier, tmp_path)
+    queries = np.random.RandomState(6).randn(40, 3) + 1.5
+    assert loaded.threshold == 0.4
+    assert_array_equal(loaded.predict_batch_and_escalations(queries)[1],
+                       classifier.predict_batch_and_escalations(queries)[1])
+    assert_array_equal(loaded.predict_batch(queries), classifier.predict_batch(queries))
+
+
+def test_load_raises_given_other_file(tmp_path):
+    path = tmp_path / "other.bin"
+    path.write_bytes(b"not a model file")
+    with pytest.raises(ValueError):
+        serialize.load(str(path))
+
+
+def test_save_raises_given_unknown_classifier(tmp_path):
+    with pytest.raises(ValueError):
+        serialize.save(object(), str(tmp_path / "model.bin"))
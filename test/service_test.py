@@ -0,0 +1,153 @@
+import asyncio
+import socket
+import struct
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+import features
+import parse
+import service
+from classification import GaussianNaiveBayesClassifier
+from helpers import nanoseconds_in_one_second, split_with_backend
+
+
+feature_functions = (features.mean_x_acceleration, features.mean_y_acceleration,
+                     features.mean_absolute_magnitude_change_per_second)
+duration = 2 * nanoseconds_in_one_second
+gap = nanoseconds_in_one_second
+
+
+def _measurements(seed, user, activity, offset, length=600):
+    rng = np.random.RandomState(seed)
+    t = 1000 * nanoseconds_in_one_second
+    out = []
+    for _ in range(length):
+        t += int(rng.randint(40, 60)) * 1000000 if rng.rand() > 0.02 else 3 * nanoseconds_in_one_second
+        out.append((user, activity, t, float(rng.randn() + offset), float(rng.randn() - offset), float(rng.randn())))
+    return tuple(out)
+
+
+def _lines(measurements):
+    return "".join("{},{},{},{},{},{};\n".format(*m) for m in measurements)
+
+
+def _classifier():
+    data = _measurements(0, 1, "Jogging", 0.0, 2000) + _measurements(1, 1, "Walking", 3.0, 2000)
+    intervals = parse.intervals_by_user_and_activity(data, duration, gap)
+    vectors = features.vectors_for_intervals(intervals, feature_functions)
+    return GaussianNaiveBayesClassifier(vectors, {"Jogging", "Walking"})
+
+
+def _expected_replies(classifier, measurements):
+    intervals = split_with_backend("python", measurements, duration, gap)
+    vectors = np.array([[features.calculate_from_measurements(i, f) for f in feature_functions] for i in intervals])
+    activities = classifier.encoder.decode(classifier.predict_batch(vectors))
+    return ["{},{},{},{}".format(i[0][0], a, i[0][2], i[-1][2]) for i, a in zip(intervals, activities)]
+
+
+def test_service_replies_match_offline_classification_for_concurrent_clients():
+    classifier = _classifier()
+    streams = [_measurements(2, 7, "Jogging", 0.0), _measurements(3, 8, "Walking", 3.0),
+               _measurements(4, 9, "Walking", 3.0)]
+
+    async def _run():
+        server = service.ClassificationService(classifier, feature_functions, duration, gap, queue_size=2)
+        await server.start()
+        try:
+            return await asyncio.gather(*(
+                service.classify_remote("127.0.0.1", server.port, _lines(s), chunk_size=997) for s in streams
+            )), server.statistics.report()
+        finally:
+            await server.close()
+
+    replies, report = asyncio.run(_run())
+    for stream, reply in zip(streams, replies):
+        expected = _expected_replies(classifier, stream)
+        assert len(expected) > 10
+        assert reply == expected
+    assert report["connections"] == 3
+    assert report["records"] == sum(len(s) for s in streams)
+    assert report["windows"] == sum(len(r) for r in replies)
+    assert report["errors"] == 0
+    assert 0 <= report["latency_p50"] <= report["latency_p90"] <= report["latency_p99"]
+    assert report["records_per_second"] > 0
+
+
+def test_service_reports_malformed_records_and_keeps_serving():
+    classifier = _classifier()
+    stream = _measurements(5, 7, "Jogging", 0.0, 200)
+    data = "7,Jogging,not_a_time,1,2,3;\n" + _lines(stream)
+
+    async def _run():
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            server = service.ClassificationService(classifier, feature_functions, duration, gap, executor=executor)
+            await server.start()
+            try:
+                return await service.classify_remote("127.0.0.1", server.port, data), server.statistics.report()
+            finally:
+                await server.close()
+
+    replies, report = asyncio.run(_run())
+    assert replies[0].startswith("error,")
+    assert replies[1:] == _expected_replies(classifier, stream)
+    assert report["errors"] == 1
+
+
+def test_service_reports_records_that_are_not_utf8_and_keeps_serving():
+    classifier = _classifier()
+    stream = _measurements(7, 7, "Jogging", 0.0, 200)
+    data = _lines(stream[:1]).encode("utf-8") + b"7,Jogging,\xff\xfe;\n" + _lines(stream[1:]).encode("utf-8")
+
+    async def _run():
+        server = service.ClassificationService(classifier, feature_functions, duration, gap)
+        await server.start()
+        try:
+            return await service.classify_remote("127.0.0.1", server.port, data, chunk_size=5), \
+                server.statistics.report()
+        finally:
+            await server.close()
+
+    replies, report = asyncio.run(_run())
+    assert replies[0].startswith("error,")
+    assert replies[1:] == _expected_replies(classifier, stream)
+    assert report["errors"] == 1
+
+
+class _SlowClassifier:
+    def __init__(self, classifier, delay):
+        self.classifier = classifier
+        self.encoder = classifier.encoder
+        self.delay = delay
+
+    def predict_batch(self, vectors):
+        time.sleep(self.delay)
+        return self.classifier.predict_batch(vectors)
+
+
+def test_service_closes_connections_reset_by_the_client_while_replies_are_queued():
+    classifier = _SlowClassifier(_classifier(), 0.05)
+    data = _lines(_measurements(6, 7, "Jogging", 0.0, 5000)).encode("utf-8")
+
+    async def _run():
+        server = service.ClassificationService(classifier, feature_functions, duration, gap, queue_size=1,
+                                               read_size=4096)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(data)
+            await writer.drain()
+            await asyncio.sleep(0.2)
+            # Close with a TCP reset without reading the replies.
+            writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            writer.transport.abort()
+            for _ in range(100):
+                if server.statistics.connection_errors > 0:
+                    break
+                await asyncio.sleep(0.05)
+            return server.statistics.report()
+        finally:
+            await asyncio.wait_for(server.close(), 5)
+
+    report = asyncio.run(_run())
+    assert report["connection_errors"] == 1
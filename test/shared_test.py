@@ -0,0 +1,55 @@
+import pickle
+import pytest
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from numpy.testing import assert_array_equal
+
+import shared
+from feature_matrix import FeatureMatrix
+
+
+def _random_matrix(seed, num_rows=1000):
+    rng = np.random.RandomState(seed)
+    return FeatureMatrix(rng.randn(num_rows, 7), rng.randint(0, 4, num_rows), rng.randint(0, 3, num_rows),
+                         np.arange(num_rows), (10, 11, 12, 13), ("Jogging", "Sitting", "Walking"))
+
+
+def _summarise(handle):
+    matrix = shared.attach(handle)
+    values = matrix.values
+    return float(np.sum(values)), matrix.activity_codes.tolist(), matrix.labels()[:3], values.flags.owndata
+
+
+def test_shared_feature_matrix_holds_a_copy_of_the_matrix():
+    matrix = _random_matrix(1)
+    with shared.SharedFeatureMatrix(matrix) as published:
+        for name in ("values", "user_codes", "activity_codes", "interval_ids"):
+            assert_array_equal(getattr(published.matrix, name), getattr(matrix, name))
+        assert shared.attach(published.handle) is published.matrix
+        assert len(pickle.dumps(published.handle)) < 500
+
+
+def test_workers_attach_without_copying():
+    matrix = _random_matrix(2)
+    with shared.SharedFeatureMatrix(matrix) as published, ProcessPoolExecutor(max_workers=2) as executor:
+        results = list(executor.map(_summarise, [published.handle] * 4))
+    for total, codes, labels, owndata in results:
+        assert total == pytest.approx(float(np.sum(matrix.values)))
+        assert codes == matrix.activity_codes.tolist()
+        assert labels == matrix.labels()[:3]
+        assert not owndata
+
+
+def test_close_unlinks_shared_memory():
+    published = shared.SharedFeatureMatrix(_random_matrix(3, num_rows=10))
+    name = published.handle.name
+    published.close()
+    published.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+
+def test_shared_feature_matrix_accepts_empty_matrix():
+    with shared.SharedFeatureMatrix(_random_matrix(4, num_rows=0)) as published:
+        assert len(shared.attach(published.handle)) == 0
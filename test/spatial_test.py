@@ -0,0 +1,124 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import accelerate
+import spatial
+from classification import KNNClassifier
+from helpers import clusters, using_backend
+
+
+def _brute_force(points, queries, k):
+    distances = np.array([((points - q) ** 2).sum(axis=1) for q in queries])
+    order = np.array([np.lexsort((np.arange(len(points)), d))[:k] for d in distances])
+    return np.take_along_axis(distances, order, axis=1), order
+
+
+def test_kd_tree_raises_given_invalid_leaf_size():
+    with pytest.raises(ValueError):
+        spatial.KDTree(np.zeros((5, 2)), leaf_size=0)
+
+
+@pytest.mark.parametrize("backend", ["python", "jit"])
+def test_kd_tree_query_matches_brute_force(backend):
+    if backend == "jit" and not accelerate.jit_available():
+        pytest.skip("numba is not installed")
+    rng = np.random.RandomState(0)
+    points = rng.randn(500, 5)
+    queries = rng.randn(20, 5)
+    tree = spatial.KDTree(points, leaf_size=8)
+    expected_distances, expected_indices = _brute_force(points, queries, 9)
+    with using_backend(backend):
+        distances, indices = tree.query(queries, 9)
+    assert_array_equal(indices, expected_indices)
+    assert_array_equal(distances, expected_distances)
+
+
+def test_kd_tree_orders_equal_distances_by_index():
+    rng = np.random.RandomState(1)
+    points = rng.randint(0, 3, size=(300, 2)).astype(float)  # Many duplicated points.
+    queries = rng.randint(0, 3, size=(10, 2)).astype(float)
+    tree = spatial.KDTree(points, leaf_size=4)
+    _, expected = _brute_force(points, queries, 25)
+    _, result = tree.query(queries, 25)
+    assert_array_equal(result, expected)
+
+
+def test_kd_tree_returns_all_points_when_k_is_larger_than_tree():
+    points = np.array([[0.0, 0.0], [3.0, 0.0], [1.0, 0.0]])
+    distances, indices = spatial.KDTree(points).query(np.array([0.0, 0.0]), 5)
+    assert_array_equal(indices, np.array([[0, 2, 1]]))
+    assert_array_equal(distances, np.array([[0.0, 1.0, 9.0]]))
+
+
+def test_knn_classifier_with_kd_tree_matches_brute_force_predictions():
+    train = clusters(2, 60, 5)
+    queries = np.random.RandomState(3).randn(40, 5) + 1.5
+    brute = KNNClassifier(train)
+    tree = KNNClassifier(train, index="kd_tree", leaf_size=10)
+    for k in (1, 6, 11):
+        expected = np.array([brute.predict_code_from_feature_vector(q, k) for q in queries])
+        assert_array_equal(tree.predict_batch(queries, k), expected)
+        assert_array_equal(np.array([tree.predict_code_from_feature_vector(q, k) for q in queries]), expected)
+
+
+def test_knn_classifier_raises_given_unknown_index():
+    with pytest.raises(ValueError):
+        KNNClassifier({(1, "a"): ((0.0,),)}, index="octree")
+
+
+def test_recall_returns_fraction_of_exact_neighbours_found():
+    exact = np.array([[0, 1, 2], [3, 4, 5]])
+    approximate = np.array([[2, 1, 9], [3, 4, 5]])
+    assert spatial.recall(approximate, exact) == 5 / 6
+
+
+def test_random_projection_index_recall_increases_with_tables():
+    rng = np.random.RandomState(3)
+    points = rng.randn(5000, 5)
+    queries = rng.randn(100, 5)
+    _, exact = _brute_force(points, queries, 10)
+    recalls = []
+    for num_trees in (1, 4, 16):
+        index = spatial.RandomProjectionIndex(points, num_trees=num_trees, seed=1)
+        recalls.append(spatial.recall(index.query(queries, 10)[1], exact))
+    assert recalls[0] < recalls[1] < recalls[2]
+    assert recalls[2] > 0.9
+
+
+def test_random_projection_index_leaves_hold_at_most_bucket_size_points():
+    rng = np.random.RandomState(4)
+    index = spatial.RandomProjectionIndex(rng.randn(3000, 5), num_trees=3, num_probes=2, bucket_size=20)
+    leaves = index.leaves(rng.randn(30, 5))
+    assert leaves.shape == (3, 3, 30)
+    for tree, tree_leaves in zip(index.trees, leaves):
+        _, starts, ends, lefts, _, _, _ = tree
+        assert np.all(lefts[tree_leaves] < 0)
+        assert np.all(ends[tree_leaves] - starts[tree_leaves] <= 20)
+
+
+@pytest.mark.parametrize("num_points, num_probes, bucket_size", [
+    (65, 2, 32), (65, 6, 16), (131, 6, 16), (260, 6, 16), (518, 6, 16), (20, 8, 32), (300, 8, 32), (1000, 4, 8),
+])
+def test_random_projection_index_pads_probes_of_shallow_trees_for_single_queries(num_points, num_probes, bucket_size):
+    rng = np.random.RandomState(num_points)
+    points = rng.randn(num_points, 3)
+    index = spatial.RandomProjectionIndex(points, num_probes=num_probes, bucket_size=bucket_size)
+    for query in rng.randn(20, 3):
+        leaves = index.leaves(query)
+        assert leaves.shape == (index.num_trees, 1 + num_probes, 1)
+    train = {(1, "a"): tuple(tuple(v) for v in points[::2]), (1, "b"): tuple(tuple(v) for v in points[1::2])}
+    classifier = KNNClassifier(train, index="approximate", num_probes=num_probes, bucket_size=bucket_size)
+    assert classifier.predict_code_from_feature_vector(points[0], 3) in (0, 1)
+
+
+def test_approximate_knn_classifier_reports_recall_and_falls_back_to_exact_search():
+    train = clusters(5, 500, 5)
+    held_out = np.random.RandomState(6).randn(50, 5) + 1.5
+    classifier = KNNClassifier(train, index="approximate", num_trees=12, seed=0)
+    assert classifier.measured_recall(held_out, 5) > 0.8
+    sparse = KNNClassifier(train, index="approximate", num_trees=1, num_probes=0, bucket_size=3)
+    incomplete = np.any(sparse.spatial_index.query(held_out, 5)[1] == 3000, axis=1)
+    assert np.any(incomplete)
+    result = sparse.nearest_indices(held_out, 5)
+    assert_array_equal(result[incomplete], sparse.exact_nearest_indices(held_out[incomplete], 5))
@@ -0,0 +1,79 @@
+import pytest
+import numpy as np
+from numpy.testing import assert_array_equal
+
+import streaming
+from helpers import nanoseconds_in_one_second, random_series, split_with_backend
+
+
+def _assert_windows_match(windows, intervals):
+    assert len(windows) == len(intervals)
+    for window, interval in zip(windows, intervals):
+        assert_array_equal(window.times, [v[2] for v in interval])
+        assert_array_equal(window.accelerations, np.array([v[3:] for v in interval]).T)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_windower_matches_split_into_intervals(seed):
+    series = random_series(seed, 3000)
+    duration, gap = 2 * nanoseconds_in_one_second, nanoseconds_in_one_second
+    windower = streaming.StreamWindower(duration, gap)
+    windows = []
+    for start in range(0, len(series), 7):
+        windows.extend(windower.extend((7, "phone"), (v[2:] for v in series[start: start + 7])))
+    windows.extend(windower.flush((7, "phone")))
+    _assert_windows_match(windows, split_with_backend("python", series, duration, gap))
+    assert len(windower) == 0
+
+
+def test_windower_keeps_streams_separate():
+    first, second = random_series(5, 1000), random_series(6, 1000)
+    duration, gap = 3 * nanoseconds_in_one_second, nanoseconds_in_one_second // 2
+    windower = streaming.StreamWindower(duration, gap)
+    windows = {"a": [], "b": []}
+    for v, w in zip(first, second):
+        for window in windower.push("a", *v[2:]) + windower.push("b", *w[2:]):
+            windows[window.key].append(window)
+    for window in windower.flush_all():
+        windows[window.key].append(window)
+    _assert_windows_match(windows["a"], split_with_backend("python", first, duration, gap))
+    _assert_windows_match(windows["b"], split_with_backend("python", second, duration, gap))
+
+
+def test_windower_discards_intervals_longer_than_capacity():
+    series = tuple((1, "Walking", 1000 + 10 * i, 1.0, 1.0, 1.0) for i in range(30))
+    windower = streaming.StreamWindower(100, 20, capacity=5)
+    windows = windower.extend(1, (v[2:] for v in series)) + windower.flush(1)
+    assert windower.overflows > 0
+    assert all(len(w) <= 5 for w in windows)
+
+
+def test_windower_raises_given_repeated_time_after_invalid_measurement():
+    windower = streaming.StreamWindower(100, 20)
+    windower.push(1, 1000, 1.0, 1.0, 1.0)
+    windower.push(1, 1010, 1.0, 1.0, 1.0)
+    windower.push(1, 0, 0, 0, 0)
+    with pytest.raises(ValueError):
+        windower.push(1, 1010, 1.0, 1.0, 1.0)
+
+
+def test_windower_continues_without_a_measurement_that_raised():
+    series = (
+        (1, "Walking", 1000, 1.0, 1.0, 1.0),
+        (1, "Walking", 1010, 1.0, 2.0, 1.0),
+        (1, "Walking", 0, 0, 0, 0),
+        (1, "Walking", 1010, 5.0, 5.0, 5.0),
+    ) + tuple((1, "Walking", 1020 + 10 * i, 1.0, float(i), 1.0) for i in range(40))
+    windower = streaming.StreamWindower(100, 20)
+    windows = []
+    for i, v in enumerate(series):
+        if i == 3:
+            with pytest.raises(ValueError):
+                windower.push(1, *v[2:])
+            continue
+        windows.extend(windower.push(1, *v[2:]))
+    windows.extend(windower.flush(1))
+    expected = split_with_backend("python", series[:3] + series[4:], 100, 20)
+    assert len(expected) > 0
+    _assert_windows_match(windows, expected)
+    assert all(np.all(np.diff(w.times) > 0) for w in windows)